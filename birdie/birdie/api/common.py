@@ -14,6 +14,9 @@
 #    under the License.
 
 
+import base64
+import hashlib
+import hmac
 import os
 import re
 import urllib
@@ -22,10 +25,11 @@ from oslo.config import cfg
 import six.moves.urllib.parse as urlparse
 import webob
 
+from birdie.common import jsonutils
 from birdie.common import log as logging
 from birdie.api.wsgi import wsgi
 from birdie.api import xmlutil
-from birdie.i18n import _
+from birdie.i18n import _, _LW
 from birdie import utils
 
 
@@ -39,6 +43,13 @@ api_common_opts = [
                help='Base URL that will be presented to users in links '
                     'to the OpenStack Volume API',
                deprecated_name='osapi_compute_link_prefix'),
+    cfg.StrOpt('osapi_cursor_secret',
+               secret=True,
+               help='Key signing the pagination cursors of collection '
+                    'resources. Set the same value on every API worker; '
+                    'required when the API runs more than one worker. '
+                    'When unset a random key is used and cursors are only '
+                    'valid within the process'),
 ]
 
 CONF = cfg.CONF
@@ -142,32 +153,263 @@ def limited(items, request, max_limit=CONF.osapi_max_limit):
     return items[offset:range_end]
 
 
-def limited_by_marker(items, request, max_limit=CONF.osapi_max_limit):
-    """Return a slice of items according to the requested marker and limit."""
+def _marker_ids(item):
+    """Return the ids a marker may refer to item by."""
+    if 'flavorid' in item:
+        return (item['flavorid'],)
+    if item.get('uuid') is not None:
+        return (item['id'], item['uuid'])
+    return (item['id'],)
+
+
+def build_marker_index(items):
+    """Map the id (and uuid) of every item to its position in items.
+
+    Build it once for a collection that is paged through repeatedly and
+    pass it to :func:`limited_by_marker` or :func:`paginate`, so finding
+    the marker no longer costs a scan of the collection.
+    """
+    index = {}
+    for i, item in enumerate(items):
+        for marker_id in _marker_ids(item):
+            index.setdefault(marker_id, i)
+    return index
+
+
+def _marker_start(items, marker, index=None):
+    """Return the position following marker in items."""
+    if not marker:
+        return 0
+    if index is not None:
+        position = index.get(marker)
+    else:
+        position = next((i for i, item in enumerate(items)
+                         if marker in _marker_ids(item)), None)
+    if position is None:
+        msg = _('marker [%s] not found') % marker
+        raise webob.exc.HTTPBadRequest(explanation=msg)
+    return position + 1
+
+
+def limited_by_marker(items, request, max_limit=CONF.osapi_max_limit,
+                      index=None):
+    """Return a slice of items according to the requested marker and limit.
+
+    :param index: optional map built by :func:`build_marker_index` over
+                  items, making the marker lookup constant time
+    """
     params = get_pagination_params(request)
 
     limit = params.get('limit', max_limit)
     marker = params.get('marker')
 
     limit = min(max_limit, limit)
-    start_index = 0
-    if marker:
-        start_index = -1
-        for i, item in enumerate(items):
-            if 'flavorid' in item:
-                if item['flavorid'] == marker:
-                    start_index = i + 1
-                    break
-            elif item['id'] == marker or item.get('uuid') == marker:
-                start_index = i + 1
-                break
-        if start_index < 0:
-            msg = _('marker [%s] not found') % marker
-            raise webob.exc.HTTPBadRequest(explanation=msg)
+    start_index = _marker_start(items, marker, index)
     range_end = start_index + limit
     return items[start_index:range_end]
 
 
+class Page(object):
+    """One page of a collection, evaluated lazily.
+
+    Iterating yields at most limit items, pulling them from the source
+    as they are consumed. One extra item is read to learn whether the
+    collection goes on; once the page has been iterated, next_marker
+    holds the marker of the following page, or None on the last one.
+    For a page sorted by sort_key, next_cursor holds the matching
+    keyset cursor.
+    """
+
+    def __init__(self, items, limit, id_key='id', sort_key=None,
+                 sort_dir=None):
+        self._items = iter(items)
+        self.limit = limit
+        self.id_key = id_key
+        self.sort_key = sort_key
+        self.sort_dir = sort_dir
+        self.next_marker = None
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        for count, item in enumerate(self._items):
+            if count == self.limit:
+                if last is not None:
+                    self.next_marker = last.get(self.id_key, last['id'])
+                    if self.sort_key:
+                        self.next_cursor = encode_cursor(
+                            self.sort_key, self.sort_dir,
+                            last.get(self.sort_key), self.next_marker)
+                return
+            last = item
+            yield item
+
+
+def paginate(items, request, max_limit=CONF.osapi_max_limit, id_key='id',
+             index=None, fetch=None):
+    """Return the page of a collection selected by the request.
+
+    The cost is that of the page, not of the collection, when the
+    backend does the work (fetch) or when items is a sequence with an
+    index from :func:`build_marker_index`. Otherwise items is scanned
+    up to the marker.
+
+    :param items: sequence or iterable of dicts; ignored with fetch
+    :param request: ``wsgi.Request`` possibly holding 'marker' and 'limit'
+    :param id_key: key of the item attribute used as the next marker
+    :param index: optional marker index over items
+    :param fetch: optional callable taking (marker, limit) and returning
+                  an iterable of up to limit items following marker, to
+                  push pagination down to the backend query
+    :returns: :class:`Page`
+    """
+    params = get_pagination_params(request)
+    limit = min(max_limit, params.get('limit') or max_limit)
+    marker = params.get('marker')
+
+    if fetch is not None:
+        source = fetch(marker, limit + 1)
+    elif index is not None:
+        start = _marker_start(items, marker, index)
+        source = items[start:start + limit + 1]
+    elif marker:
+        source = _after_marker(items, marker)
+    else:
+        source = items
+    return Page(source, limit, id_key=id_key)
+
+
+_RANDOM_CURSOR_SECRET = None
+
+
+def _cursor_signature(payload):
+    global _RANDOM_CURSOR_SECRET
+    secret = CONF.osapi_cursor_secret
+    if secret:
+        secret = secret.encode('utf-8')
+    else:
+        if _RANDOM_CURSOR_SECRET is None:
+            LOG.warn(_LW("osapi_cursor_secret is not set, pagination "
+                         "cursors are signed with a random key and only "
+                         "valid within this process"))
+            _RANDOM_CURSOR_SECRET = os.urandom(32)
+        secret = _RANDOM_CURSOR_SECRET
+    return hmac.new(secret, payload, hashlib.sha256).hexdigest()
+
+
+def encode_cursor(sort_key, sort_dir, value, last_id):
+    """Return an opaque, signed cursor for the items after last_id.
+
+    The cursor is a keyset position: the sort key and direction it was
+    made for, and the sort value and id of the last item seen.
+    """
+    payload = base64.urlsafe_b64encode(
+        jsonutils.dumps([sort_key, sort_dir, value, last_id]).encode('utf-8'))
+    return '%s.%s' % (payload.decode('ascii'), _cursor_signature(payload))
+
+
+def decode_cursor(cursor, sort_key, sort_dir):
+    """Return (value, last_id) from a cursor made by :func:`encode_cursor`.
+
+    :raises webob.exc.HTTPBadRequest: if the cursor was tampered with or
+        was made for another sort order
+    """
+    payload, _sep, signature = cursor.partition('.')
+    payload = payload.encode('ascii', 'ignore')
+    if not hmac.compare_digest(_cursor_signature(payload).encode('ascii'),
+                               signature.encode('ascii', 'ignore')):
+        msg = _('Invalid cursor')
+        raise webob.exc.HTTPBadRequest(explanation=msg)
+    key, direction, value, last_id = jsonutils.loads(
+        base64.urlsafe_b64decode(payload))
+    if (key, direction) != (sort_key, sort_dir):
+        msg = _('The cursor was made for another sort order')
+        raise webob.exc.HTTPBadRequest(explanation=msg)
+    return value, last_id
+
+
+def get_cursor_sort_params(request, allowed_keys, default_key='created_at',
+                           default_dir='desc'):
+    """Return the sort key and direction of a cursor paginated request.
+
+    Keyset cursors support a single sort key, always followed by the id
+    to break ties.
+    """
+    sort_keys, sort_dirs = get_sort_params(request.GET.copy(), default_key,
+                                           default_dir)
+    if len(sort_keys) != 1:
+        msg = _('Only one sort key is supported')
+        raise webob.exc.HTTPBadRequest(explanation=msg)
+    if sort_keys[0] not in allowed_keys:
+        msg = _('Invalid sort key %s') % sort_keys[0]
+        raise webob.exc.HTTPBadRequest(explanation=msg)
+    if sort_dirs[0] not in ('asc', 'desc'):
+        msg = _('Invalid sort direction %s') % sort_dirs[0]
+        raise webob.exc.HTTPBadRequest(explanation=msg)
+    return sort_keys[0], sort_dirs[0]
+
+
+def keyset_filter(items, sort_key, sort_dir, after=None, id_key='id'):
+    """Sort items by (sort_key, id) and keep those past after.
+
+    :param after: (value, id) position from :func:`decode_cursor`
+    """
+    def _position(value, item_id):
+        # Items without a value sort first, whatever the value type is.
+        return (value is not None, value, item_id)
+
+    def position(item):
+        return _position(item.get(sort_key), item[id_key])
+
+    ordered = sorted(items, key=position, reverse=(sort_dir == 'desc'))
+    if after is None:
+        return ordered
+    after = _position(*after)
+    if sort_dir == 'desc':
+        return [item for item in ordered if position(item) < after]
+    return [item for item in ordered if position(item) > after]
+
+
+def paginate_by_cursor(items, request, sort_key, sort_dir,
+                       max_limit=CONF.osapi_max_limit, id_key='id',
+                       fetch=None):
+    """Return the page of a collection selected by the request's cursor.
+
+    Unlike markers, a keyset cursor does not depend on where the last
+    item sits in the collection, so pages stay stable while items are
+    added, and a backend can seek to it directly.
+
+    :param items: iterable of dicts; ignored with fetch
+    :param request: ``wsgi.Request`` possibly holding 'cursor' and 'limit'
+    :param sort_key, sort_dir: from :func:`get_cursor_sort_params`
+    :param fetch: optional callable taking (sort_key, sort_dir, after,
+                  limit) and returning up to limit items sorted and
+                  following after, a (value, id) position or None
+    :returns: :class:`Page` with next_cursor set once it is iterated
+    """
+    params = get_pagination_params(request)
+    limit = min(max_limit, params.get('limit') or max_limit)
+    after = None
+    if request.GET.get('cursor'):
+        after = decode_cursor(request.GET['cursor'], sort_key, sort_dir)
+
+    if fetch is not None:
+        source = fetch(sort_key, sort_dir, after, limit + 1)
+    else:
+        source = keyset_filter(items, sort_key, sort_dir, after, id_key)
+    return Page(source, limit, id_key=id_key, sort_key=sort_key,
+                sort_dir=sort_dir)
+
+
+def _after_marker(items, marker):
+    iterator = iter(items)
+    for item in iterator:
+        if marker in _marker_ids(item):
+            return iterator
+    msg = _('marker [%s] not found') % marker
+    raise webob.exc.HTTPBadRequest(explanation=msg)
+
+
 def get_sort_params(params, default_key='created_at', default_dir='desc'):
     """Retrieves sort keys/directions parameters.
 
@@ -332,6 +574,30 @@ class ViewBuilder(object):
                                                 collection_name)
         return []
 
+    def _get_page_links(self, request, page, collection_name):
+        """Return the 'next' link of a :class:`Page` already iterated."""
+        if page.next_cursor is not None:
+            href = self._get_cursor_link(request, page.next_cursor,
+                                         collection_name)
+        elif page.next_marker is not None:
+            href = self._get_next_link(request, page.next_marker,
+                                       collection_name)
+        else:
+            return []
+        return [{"rel": "next", "href": href}]
+
+    def _get_cursor_link(self, request, cursor, collection_name):
+        """Return href string with proper limit and cursor params."""
+        params = request.params.copy()
+        params.pop("marker", None)
+        params["cursor"] = cursor
+        prefix = self._update_link_prefix(request.application_url,
+                                          CONF.osapi_volume_base_URL)
+        url = os.path.join(prefix,
+                           request.environ["birdie.context"].project_id,
+                           collection_name)
+        return "%s?%s" % (url, urllib.urlencode(params))
+
     def _generate_next_link(self, items, id_key, request,
                             collection_name):
         links = []
@@ -62,6 +62,15 @@ def pipeline_factory(loader, global_conf, **local_conf):
 
 
 
+def _get_token_expiry(token_info):
+    """Return the token expiry set by keystonemiddleware, if any."""
+    if not token_info:
+        return None
+    if 'access' in token_info:
+        return token_info['access'].get('token', {}).get('expires')
+    return token_info.get('token', {}).get('expires_at')
+
+
 class InjectContext(base_wsgi.Middleware):
     """Add a 'cinder.context' to WSGI environ."""
 
@@ -101,6 +110,8 @@ class V2vKeystoneContext(base_wsgi.Middleware):
         # Get the auth token
         auth_token = req.headers.get('X_AUTH_TOKEN',
                                      req.headers.get('X_STORAGE_TOKEN'))
+        auth_token_expires = _get_token_expiry(
+            req.environ.get('keystone.token_info'))
 
         # Build a context, including the auth_token...
         remote_address = req.remote_addr
@@ -121,6 +132,7 @@ class V2vKeystoneContext(base_wsgi.Middleware):
                                      project_name=project_name,
                                      roles=roles,
                                      auth_token=auth_token,
+                                     auth_token_expires=auth_token_expires,
                                      remote_address=remote_address,
                                      service_catalog=service_catalog,
                                      request_id=req_id)
@@ -0,0 +1,77 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""The migrations api."""
+
+from webob import exc
+
+from birdie.api import common
+from birdie.api.views import migrations as migrations_view
+from birdie.api.wsgi import wsgi
+from birdie.common import log as logging
+from birdie import exception
+from birdie.server import api as server_api
+
+
+LOG = logging.getLogger(__name__)
+
+_SORT_KEYS = ('created_at', 'started_at', 'finished_at', 'state', 'priority',
+              'host', 'id')
+
+
+class MigrationController(wsgi.Controller):
+    """The migrations API controller."""
+
+    def __init__(self, ext_mgr):
+        self.ext_mgr = ext_mgr
+        self.view_builder = migrations_view.ViewBuilder()
+        self.server_api = server_api.MigrationAPI()
+        super(MigrationController, self).__init__()
+
+    def index(self, req):
+        """Returns the list of migrations."""
+        context = req.environ['birdie.context']
+        sort_key, sort_dir = common.get_cursor_sort_params(
+            req, _SORT_KEYS, default_dir='asc')
+
+        def fetch(sort_key, sort_dir, after, limit):
+            return self.server_api.get_all(context, sort_key=sort_key,
+                                           sort_dir=sort_dir, after=after,
+                                           limit=limit)
+
+        migrations = common.paginate_by_cursor(None, req, sort_key, sort_dir,
+                                               fetch=fetch)
+        return self.view_builder.list(req, migrations)
+
+    def show(self, req, id):
+        """Return data about the given migration."""
+        context = req.environ['birdie.context']
+        try:
+            migration = self.server_api.get_migration(context, id)
+        except exception.MigrationNotFound as error:
+            raise exc.HTTPNotFound(explanation=error.msg)
+        return self.view_builder.show(migration)
+
+    def progress(self, req, id):
+        """Return bytes copied, rate, ETA and phase durations."""
+        context = req.environ['birdie.context']
+        try:
+            progress = self.server_api.get_migration_progress(context, id)
+        except exception.MigrationNotFound as error:
+            raise exc.HTTPNotFound(explanation=error.msg)
+        return self.view_builder.progress(progress)
+
+
+def create_resource(ext_mgr):
+    return wsgi.Resource(MigrationController(ext_mgr))
@@ -24,6 +24,7 @@ from birdie.common import log as logging
 from birdie.api import extensions
 import birdie.api.wsgi
 
+from birdie.api.v1 import migrations
 from birdie.api.v1 import services
 
 
@@ -43,4 +44,9 @@ class APIRouter(birdie.api.wsgi.APIRouter):
                         collection={'detail': 'GET'},
                         member={'action': 'POST'})
 
+        self.resources['migrations'] = migrations.create_resource(ext_mgr)
+        mapper.resource("migration", "migrations",
+                        controller=self.resources['migrations'],
+                        member={'progress': 'GET'})
+
        
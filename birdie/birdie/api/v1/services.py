@@ -35,6 +35,9 @@ from birdie.server import api as server_api
 
 LOG = logging.getLogger(__name__)
 
+_RESOURCE_SORT_KEYS = ('created_at', 'id', 'status', 'size',
+                       'display_name', 'availability_zone')
+
 
 class ServiceController(wsgi.Controller):
     """The Volumes API controller for the OpenStack API."""
@@ -65,33 +68,37 @@ class ServiceController(wsgi.Controller):
     def index(self, req):
         """Returns a summary list of resource."""
         LOG.debug("index is start.")
-        context = req.environ['birdie.context']
-        #1. query info from server model
-        vols = self.cinder_api.get_all(context)
-        
-        LOG.debug("index volumes: %s", str(vols))
-        #2. transform result to UI needed object mode      
-        return self.viewBulid.list(vols)
+        return self._items(req, self.viewBulid.list)
 
     def detail(self, req):
         """Returns a detailed list of resource."""
         LOG.debug("Detail is start.")
-        
+        return self._items(req, self.viewBulid.detail)
+
+    def _items(self, req, view):
+        """Returns a page of resource, selected by the request's cursor."""
         context = req.environ['birdie.context']
-        
-        obj = {
-            "resources": [{
-                "id": "123",
-                "name":"birdie-test",
-            },
-                          
-            {
-                "id": "1234",
-                "name":"birdie-test2",
-            }] 
-        }
-          
-        return obj
+        sort_key, sort_dir = common.get_cursor_sort_params(
+            req, _RESOURCE_SORT_KEYS)
+        search_opts = {}
+        search_opts.update(req.GET)
+        for key in ('marker', 'cursor', 'limit', 'offset',
+                    'sort', 'sort_key', 'sort_dir'):
+            search_opts.pop(key, None)
+        #1. query info from server model, one page at a time; the cursor
+        #   position and sort order are passed down to cinder
+        def fetch(sort_key, sort_dir, after, limit):
+            marker = after[1] if after else None
+            return self.cinder_api.iter_all(context, search_opts=search_opts,
+                                            page_size=limit, marker=marker,
+                                            sort_key=sort_key,
+                                            sort_dir=sort_dir)
+
+        vols = common.paginate_by_cursor(None, req, sort_key, sort_dir,
+                                         fetch=fetch)
+
+        #2. transform result to UI needed object mode      
+        return view(req, vols)
 
     def create(self, req, body):
         """Creates a new resource."""
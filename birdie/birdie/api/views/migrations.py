@@ -0,0 +1,50 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from birdie.api import common
+
+
+class ViewBuilder(common.ViewBuilder):
+    """Model migration API responses as a python dictionary."""
+
+    _collection_name = "migrations"
+
+    def _summary(self, migration):
+        return {'id': migration['id'],
+                'host': migration['host'],
+                'state': migration['state'],
+                'priority': migration['priority'],
+                'error': migration['error'],
+                'created_at': migration['created_at'],
+                'started_at': migration['started_at'],
+                'finished_at': migration['finished_at']}
+
+    def list(self, request, migrations):
+        """Show a page of migrations.
+
+        :param migrations: :class:`birdie.api.common.Page` of migrations
+        """
+        result = {'migrations': [self._summary(migration)
+                                 for migration in migrations]}
+        links = self._get_page_links(request, migrations,
+                                     self._collection_name)
+        if links:
+            result['migrations_links'] = links
+        return result
+
+    def show(self, migration):
+        return {'migration': self._summary(migration)}
+
+    def progress(self, progress):
+        return {'progress': progress}
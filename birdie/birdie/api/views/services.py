@@ -15,24 +15,43 @@
 from birdie.common import log as logging
 
 from birdie.api.common import ViewBuilder
+from birdie.api.wsgi import wsgi
 
 LOG = logging.getLogger(__name__)
 
 class ViewBuilder(ViewBuilder):
     
-    def list(self, results):
-        objs = {
-            "resources": [{
-                "id": "1234",
-                "name":"birdie-test1234",
-            },
-            {
-                "id": "1235",
-                "name":"birdie-test1235",
-            }]
-        }
-         
-        return objs
+    _collection_name = "resources"
+
+    def _summary(self, volume):
+        return {'id': volume['id'],
+                'name': volume['display_name'],
+                'status': volume['status']}
+
+    def _detail(self, volume):
+        resource = self._summary(volume)
+        resource.update({'size': volume['size'],
+                         'availability_zone': volume['availability_zone'],
+                         'created_at': volume['created_at']})
+        return resource
+
+    def list(self, request, results):
+        """Show a page of resources.
+
+        :param results: :class:`birdie.api.common.Page` of volumes
+        """
+        return self._list(request, results, self._summary)
+
+    def detail(self, request, results):
+        """Detailed view of a page of resources."""
+        return self._list(request, results, self._detail)
+
+    def _list(self, request, results, item_view):
+        """Stream the page; its links are known once it has been read."""
+        return wsgi.StreamingCollection(
+            "resources", (item_view(volume) for volume in results),
+            links=lambda: self._get_page_links(request, results,
+                                               self._collection_name))
     
     def show(self,result):
         
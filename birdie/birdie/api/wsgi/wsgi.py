@@ -14,7 +14,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
 import inspect
+import itertools
+import json
 import math
 import time
 from xml.dom import minidom
@@ -23,6 +26,8 @@ from xml.parsers import expat
 from lxml import etree
 from oslo.serialization import jsonutils
 from oslo.utils import excutils
+from oslo.utils import importutils
+from oslo.utils import timeutils
 import six
 import webob
 
@@ -40,6 +45,9 @@ XML_NS_ATOM = 'http://www.w3.org/2005/Atom'
 
 LOG = logging.getLogger(__name__)
 
+# C accelerated and output compatible with json; used when installed.
+simplejson = importutils.try_import('simplejson')
+
 SUPPORTED_CONTENT_TYPES = (
     'application/json',
     'application/vnd.openstack.volume+json',
@@ -410,11 +418,78 @@ class DictSerializer(ActionDispatcher):
         return ""
 
 
+def _json_default(value):
+    """Encode the values json cannot, as jsonutils.dumps would.
+
+    The encoder only calls this for values that are not already JSON
+    types, so plain payloads never reach to_primitive. Datetimes, the
+    one such type every response carries, are formatted here directly.
+    """
+    if isinstance(value, datetime.datetime):
+        if value.year < 1000:
+            # strftime does not zero pad those years on every platform.
+            return value.strftime(timeutils.PERFECT_TIME_FORMAT)
+        # Same output as PERFECT_TIME_FORMAT, at half the cost of strftime.
+        return '%04d-%02d-%02dT%02d:%02d:%02d.%06d' % (
+            value.year, value.month, value.day, value.hour, value.minute,
+            value.second, value.microsecond)
+    return jsonutils.to_primitive(value)
+
+
+def _make_json_encoder():
+    if simplejson is not None:
+        # Keep tuples, namedtuples and Decimals encoded as json does.
+        return simplejson.JSONEncoder(default=_json_default,
+                                      namedtuple_as_object=False,
+                                      use_decimal=False)
+    return json.JSONEncoder(default=_json_default)
+
+
+# Encoders are stateless, so one is shared instead of json.dumps building
+# a new one for every response.
+_JSON_ENCODER = _make_json_encoder()
+
+
 class JSONDictSerializer(DictSerializer):
     """Default JSON request body serialization."""
 
+    # Bytes gathered before a chunk of a streamed collection is sent.
+    stream_chunk_size = 64 * 1024
+
     def default(self, data):
-        return jsonutils.dumps(data)
+        return _JSON_ENCODER.encode(data)
+
+    def serialize_iter(self, collection):
+        """Yield the JSON of a :class:`StreamingCollection` in chunks.
+
+        Items are encoded one at a time as they are read from the
+        collection, so only one chunk is held in memory.
+        """
+        parts = ['{%s: [' % _JSON_ENCODER.encode(collection.name)]
+        size = len(parts[0])
+        separator = ''
+        for item in collection:
+            encoded = separator + _JSON_ENCODER.encode(item)
+            separator = ', '
+            parts.append(encoded)
+            size += len(encoded)
+            if size >= self.stream_chunk_size:
+                yield _to_bytes(''.join(parts))
+                parts, size = [], 0
+        parts.append(']')
+        links = collection.get_links()
+        if links:
+            parts.append(', %s: %s' % (
+                _JSON_ENCODER.encode(collection.name + '_links'),
+                _JSON_ENCODER.encode(links)))
+        parts.append('}')
+        yield _to_bytes(''.join(parts))
+
+
+def _to_bytes(chunk):
+    if isinstance(chunk, six.text_type):
+        return chunk.encode('utf-8')
+    return chunk
 
 
 class XMLDictSerializer(DictSerializer):
@@ -568,6 +643,53 @@ def response(code):
     return decorator
 
 
+class StreamingCollection(object):
+    """A collection the controller lets the serializer stream.
+
+    Controller methods may return one instead of a dict to have a list
+    response sent as it is produced: {name: [items...], name_links:
+    links}. Serializers with a serialize_iter() method stream it as a
+    chunked response; the others get it materialized by :meth:`to_dict`.
+
+    The first item is read before the response starts, so a failing
+    backend query still returns a fault; a later error while iterating
+    cuts the response short instead. Post-processing extensions cannot
+    change a streamed body.
+    """
+
+    def __init__(self, name, items, links=None):
+        """Initialize the collection.
+
+        :param name: key of the item list, e.g. 'resources'
+        :param items: iterable of the items, as dicts
+        :param links: optional callable returning the collection links;
+                      it is called once all items have been read, so it
+                      may depend on how far the iteration went
+        """
+        self.name = name
+        self._items = iter(items)
+        self._links = links
+        self._head = []
+
+    def prefetch(self):
+        """Read the first item ahead of the iteration."""
+        if not self._head:
+            self._head = list(itertools.islice(self._items, 1))
+
+    def __iter__(self):
+        return itertools.chain(self._head, self._items)
+
+    def get_links(self):
+        return self._links() if self._links else []
+
+    def to_dict(self):
+        data = {self.name: list(self)}
+        links = self.get_links()
+        if links:
+            data[self.name + '_links'] = links
+        return data
+
+
 class ResponseObject(object):
     """Bundles a response object with appropriate serializers.
 
@@ -684,7 +806,14 @@ class ResponseObject(object):
         for hdr, value in self._headers.items():
             response.headers[hdr] = value
         response.headers['Content-Type'] = content_type
-        if self.obj is not None:
+        if isinstance(self.obj, StreamingCollection):
+            if hasattr(serializer, 'serialize_iter'):
+                # No Content-Length, so the body is sent chunked.
+                response.app_iter = serializer.serialize_iter(self.obj)
+                response.content_length = None
+            else:
+                response.body = serializer.serialize(self.obj.to_dict())
+        elif self.obj is not None:
             response.body = serializer.serialize(self.obj)
 
         return response
@@ -1025,6 +1154,11 @@ class Resource(wsgi.Application):
             try:
                 with ResourceExceptionHandler():
                     action_result = self.dispatch(meth, request, action_args)
+                    if isinstance(action_result, StreamingCollection):
+                        # Errors of a lazy backend query mostly show on the
+                        # first item; get it while they can still become
+                        # a fault.
+                        action_result.prefetch()
             except Fault as ex:
                 response = ex
 
@@ -1032,7 +1166,8 @@ class Resource(wsgi.Application):
             # No exceptions; convert action_result into a
             # ResponseObject
             resp_obj = None
-            if type(action_result) is dict or action_result is None:
+            if (type(action_result) is dict or action_result is None or
+                    isinstance(action_result, StreamingCollection)):
                 resp_obj = ResponseObject(action_result)
             elif isinstance(action_result, ResponseObject):
                 resp_obj = action_result
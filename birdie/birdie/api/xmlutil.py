@@ -34,6 +34,15 @@ XMLNS_VOLUME_V2 = ('http://docs.openstack.org/api/openstack-block-storage/2.0/'
 
 _split_pattern = re.compile(r'([^:{]*{[^}]*}[^:]*|[^:]+)')
 
+# Bumped whenever a template element that is part of a compiled render
+# plan changes, which makes every cached plan be compiled again.
+_plan_generation = 0
+
+
+def _invalidate_plans():
+    global _plan_generation
+    _plan_generation += 1
+
 
 def validate_schema(xml, schema_name):
     if isinstance(xml, str):
@@ -179,6 +188,8 @@ class TemplateElement(object):
         self._text = None
         self._children = []
         self._childmap = {}
+        self._compiled = False
+        self._split_tag = None
 
         # Run the incoming attributes through set() so that they
         # become selectorized
@@ -214,9 +225,15 @@ class TemplateElement(object):
         else:
             return self._children[idx]
 
+    def _changed(self):
+        if self._compiled:
+            _invalidate_plans()
+
     def append(self, elem):
         """Append a child to the element."""
 
+        self._changed()
+
         # Unwrap templates...
         elem = elem.unwrap()
 
@@ -230,6 +247,8 @@ class TemplateElement(object):
     def extend(self, elems):
         """Append children to the element."""
 
+        self._changed()
+
         # Pre-evaluate the elements
         elemmap = {}
         elemlist = []
@@ -251,6 +270,8 @@ class TemplateElement(object):
     def insert(self, idx, elem):
         """Insert a child element at the given index."""
 
+        self._changed()
+
         # Unwrap templates...
         elem = elem.unwrap()
 
@@ -264,6 +285,8 @@ class TemplateElement(object):
     def remove(self, elem):
         """Remove a child element."""
 
+        self._changed()
+
         # Unwrap templates...
         elem = elem.unwrap()
 
@@ -302,6 +325,7 @@ class TemplateElement(object):
         elif not callable(value):
             value = Selector(value)
 
+        self._changed()
         self.attrib[key] = value
 
     def keys(self):
@@ -382,16 +406,16 @@ class TemplateElement(object):
         # Allocate a node
         if callable(self.tag):
             tagname = self.tag(datum)
+            tagnameList = self._splitTagName(tagname)
         else:
-            tagname = self.tag
-
-        # If the datum is None
-        if datum is not None:
-            tmpattrib = self.getAttrib(datum)
-        else:
-            tmpattrib = {}
-
-        tagnameList = self._splitTagName(tagname)
+            # A static tag is only split once
+            if self._split_tag is None or self._split_tag[0] != self.tag:
+                self._split_tag = (self.tag, self._splitTagName(self.tag))
+            tagnameList = self._split_tag[1]
+
+        # The attributes are only compared when there is an element
+        # to merge with, so only select them then
+        tmpattrib = None
         insertIndex = 0
 
         # If parent is not none and has same tagname
@@ -400,7 +424,12 @@ class TemplateElement(object):
                 tmpInsertPos = parent.find(tagnameList[i])
                 if tmpInsertPos is None:
                     break
-                elif not cmp(parent.attrib, tmpattrib) == 0:
+                if tmpattrib is None:
+                    if datum is not None:
+                        tmpattrib = self.getAttrib(datum)
+                    else:
+                        tmpattrib = {}
+                if not cmp(parent.attrib, tmpattrib) == 0:
                     break
                 parent = tmpInsertPos
                 insertIndex = i + 1
@@ -512,9 +541,11 @@ class TemplateElement(object):
         if value is not None and not callable(value):
             value = Selector(value)
 
+        self._changed()
         self._text = value
 
     def _text_del(self):
+        self._changed()
         self._text = None
 
     text = property(_text_get, _text_set, _text_del)
@@ -549,6 +580,57 @@ class TemplateElement(object):
                 (' '.join(contents), ''.join(children), self.tag))
 
 
+class _RenderNode(object):
+    """One step of a compiled render plan.
+
+    Holds the template element rendered at this point of the tree, the
+    elements of other templates patched onto it, and the nodes of its
+    children, merged across all the templates.
+    """
+
+    __slots__ = ('element', 'patches', 'children')
+
+    def __init__(self, element, patches, children):
+        self.element = element
+        self.patches = patches
+        self.children = children
+
+    def render(self, parent, obj, nsmap=None):
+        """Render obj; returns the (element, datum) pairs rendered."""
+
+        elems = self.element.render(parent, obj, self.patches, nsmap)
+        for child in self.children:
+            for elem, datum in elems:
+                child.render(elem, datum)
+        return elems
+
+
+def _compile(siblings):
+    """Compile the siblings of a template tree into a :class:`_RenderNode`.
+    """
+
+    for sibling in siblings:
+        sibling._compiled = True
+
+    children = []
+    seen = set()
+    for idx, sibling in enumerate(siblings):
+        for child in sibling:
+            # Have we handled this child already?
+            if child.tag in seen:
+                continue
+            seen.add(child.tag)
+
+            # Determine the child's siblings
+            nieces = [child]
+            for sib in siblings[idx + 1:]:
+                if child.tag in sib:
+                    nieces.append(sib[child.tag])
+            children.append(_compile(nieces))
+
+    return _RenderNode(siblings[0], siblings[1:], tuple(children))
+
+
 def SubTemplateElement(parent, tag, attrib=None, selector=None,
                        subselector=None, **extra):
     """Create a template element as a child of another.
@@ -587,50 +669,7 @@ class Template(object):
         self.root = root.unwrap() if root is not None else None
         self.nsmap = nsmap or {}
         self.serialize_options = dict(encoding='UTF-8', xml_declaration=True)
-
-    def _serialize(self, parent, obj, siblings, nsmap=None):
-        """Internal serialization.
-
-        Recursive routine to build a tree of etree.Element instances
-        from an object based on the template.  Returns the first
-        etree.Element instance rendered, or None.
-
-        :param parent: The parent etree.Element instance.  Can be
-                       None.
-        :param obj: The object to render.
-        :param siblings: The TemplateElement instances against which
-                         to render the object.
-        :param nsmap: An optional namespace dictionary to be
-                      associated with the etree.Element instance
-                      rendered.
-        """
-
-        # First step, render the element
-        elems = siblings[0].render(parent, obj, siblings[1:], nsmap)
-
-        # Now, traverse all child elements
-        seen = set()
-        for idx, sibling in enumerate(siblings):
-            for child in sibling:
-                # Have we handled this child already?
-                if child.tag in seen:
-                    continue
-                seen.add(child.tag)
-
-                # Determine the child's siblings
-                nieces = [child]
-                for sib in siblings[idx + 1:]:
-                    if child.tag in sib:
-                        nieces.append(sib[child.tag])
-
-                # Now call this function for all data elements recursively
-                for elem, datum in elems:
-                    self._serialize(elem, datum, nieces)
-
-        # Return the first element; at the top level, this will be the
-        # root element
-        if elems:
-            return elems[0][0]
+        self._plans = {}
 
     def serialize(self, obj, *args, **kwargs):
         """Serialize an object.
@@ -665,12 +704,35 @@ class Template(object):
         if self.root is None:
             return None
 
-        # Get the siblings and nsmap of the root element
-        siblings = self._siblings()
-        nsmap = self._nsmap()
+        # Form the element tree from the compiled plan
+        plan, nsmap = self._render_plan()
+        elems = plan.render(None, obj, nsmap)
+        if elems:
+            return elems[0][0]
+
+    def _plan_key(self):
+        """Hook method for the key render plans are cached under.
+
+        An overridable hook method; templates producing different
+        siblings or namespaces must return different keys.
+        """
+
+        return ()
 
-        # Form the element tree
-        return self._serialize(None, obj, siblings, nsmap)
+    def _render_plan(self):
+        """Return the compiled render plan and the namespace dictionary.
+
+        Both are computed once per plan key and reused as long as no
+        template element in the plan changes.
+        """
+
+        key = self._plan_key()
+        cached = self._plans.get(key)
+        if cached is None or cached[0] != _plan_generation:
+            cached = (_plan_generation, _compile(self._siblings()),
+                      self._nsmap())
+            self._plans[key] = cached
+        return cached[1], cached[2]
 
     def _siblings(self):
         """Hook method for computing root siblings.
@@ -762,6 +824,11 @@ class MasterTemplate(Template):
 
         return [self.root] + [slave.root for slave in self.slaves]
 
+    def _plan_key(self):
+        """Render plans depend on the version and the attached slaves."""
+
+        return (self.version, tuple(slave.root for slave in self.slaves))
+
     def _nsmap(self):
         """Hook method for computing the namespace dictionary.
 
@@ -815,6 +882,8 @@ class MasterTemplate(Template):
         # Return a copy of the MasterTemplate
         tmp = self.__class__(self.root, self.version, self.nsmap)
         tmp.slaves = self.slaves[:]
+        # Copies made per request share the compiled render plans
+        tmp._plans = self._plans
         return tmp
 
 
@@ -21,8 +21,11 @@ OpenStack Client interface. Handles the REST calls and responses.
 from __future__ import print_function
 
 import logging
+import threading
+import time
 
 import requests
+from requests import adapters
 
 from birdie.birdiegatewayclient.common import exceptions
 from birdie.common import strutils
@@ -51,6 +54,90 @@ if not hasattr(urlparse, 'parse_qsl'):
 
 _VALID_VERSIONS = ['v1']
 
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_POOL_IDLE_TIMEOUT = 60
+DEFAULT_CONNECT_RETRIES = 0
+
+
+class _PooledSession(object):
+    """A keep-alive requests.Session bound to a single gateway."""
+
+    def __init__(self, pool_connections, pool_maxsize, idle_timeout,
+                 connect_retries):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.idle_timeout = idle_timeout
+        self.connect_retries = connect_retries
+        self.session = None
+        self.last_used = 0
+        self._lock = threading.Lock()
+
+    def _create(self):
+        session = requests.Session()
+        adapter = adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                       pool_maxsize=self.pool_maxsize,
+                                       max_retries=self.connect_retries)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get(self):
+        """Return the live session, recycling it when it sat idle too long.
+
+        Gateways drop keep-alive connections that stay unused; recycling the
+        session avoids sending the next request down a half-closed socket.
+        """
+        with self._lock:
+            now = time.time()
+            if (self.session is not None and self.idle_timeout and
+                    now - self.last_used > self.idle_timeout):
+                self.session.close()
+                self.session = None
+            if self.session is None:
+                self.session = self._create()
+            self.last_used = now
+            return self.session
+
+    def close(self):
+        with self._lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _get_pooled_session(url, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                        idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT,
+                        connect_retries=DEFAULT_CONNECT_RETRIES):
+    """Return the session shared by every client talking to url's gateway.
+
+    Sessions are keyed by scheme and network location, so all
+    VServiceManager instances for one gateway reuse the same connections.
+    The pool settings of the first caller for a gateway win.
+    """
+    scheme, netloc = urlparse.urlsplit(url)[:2]
+    key = (scheme, netloc)
+    with _SESSIONS_LOCK:
+        pooled = _SESSIONS.get(key)
+        if pooled is None:
+            pooled = _PooledSession(pool_connections, pool_maxsize,
+                                    idle_timeout, connect_retries)
+            _SESSIONS[key] = pooled
+    return pooled.get()
+
+
+def reset_sessions():
+    """Close and forget every pooled gateway session."""
+    with _SESSIONS_LOCK:
+        for pooled in _SESSIONS.values():
+            pooled.close()
+        _SESSIONS.clear()
+
 
 class HTTPClient(object):
 
@@ -61,7 +148,11 @@ class HTTPClient(object):
                  proxy_tenant_id=None, proxy_token=None, region_name=None,
                  service_name=None, retries=None,
                  http_log_debug=False, cacert=None,
-                 auth_system=None, auth_plugin=None):
+                 auth_system=None, auth_plugin=None,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 pool_idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT,
+                 connect_retries=DEFAULT_CONNECT_RETRIES):
         self.user = user
         self.password = password
         self.projectid = projectid
@@ -91,6 +182,11 @@ class HTTPClient(object):
         self.auth_system = auth_system
         self.auth_plugin = auth_plugin
 
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_idle_timeout = pool_idle_timeout
+        self.connect_retries = connect_retries
+
         self._logger = logging.getLogger(__name__)
 
     def http_log_req(self, args, kwargs):
@@ -137,7 +233,12 @@ class HTTPClient(object):
         if self.timeout:
             kwargs.setdefault('timeout', self.timeout)
         self.http_log_req((url, method,), kwargs)
-        resp = requests.request(
+        session = _get_pooled_session(url,
+                                      pool_connections=self.pool_connections,
+                                      pool_maxsize=self.pool_maxsize,
+                                      idle_timeout=self.pool_idle_timeout,
+                                      connect_retries=self.connect_retries)
+        resp = session.request(
             method,
             url,
             verify=self.verify_cert,
@@ -170,8 +271,8 @@ class HTTPClient(object):
             #if self.projectid:
                 #kwargs['headers']['X-Auth-Project-Id'] = self.projectid
             try:
-                resp, body = self.request(self.management_url + url, method,
-                                          **kwargs)
+                resp, body = self.request((self.management_url or '') + url,
+                                          method, **kwargs)
                 return resp, body
             except exceptions.BadRequest as e:
                 if attempts > self.retries:
@@ -228,6 +329,10 @@ def _construct_http_client(username=None, password=None, project_id=None,
                            cacert=None, tenant_id=None,
                            session=None,
                            auth=None,
+                           pool_connections=DEFAULT_POOL_CONNECTIONS,
+                           pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                           pool_idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT,
+                           connect_retries=DEFAULT_CONNECT_RETRIES,
                            **kwargs):
 
         # FIXME(jamielennox): username and password are now optional. Need
@@ -248,6 +353,10 @@ def _construct_http_client(username=None, password=None, project_id=None,
                     cacert=cacert,
                     auth_system=auth_system,
                     auth_plugin=auth_plugin,
+                    pool_connections=pool_connections,
+                    pool_maxsize=pool_maxsize,
+                    pool_idle_timeout=pool_idle_timeout,
+                    connect_retries=connect_retries,
                     )
 
 
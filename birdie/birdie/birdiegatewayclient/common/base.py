@@ -59,6 +59,7 @@ class Manager(object):
             resp, body = self.client.post(url, body=body)
         else:
             resp, body = self.client.get(url)
+        return body
 
     def _get(self, url, response_key=None):
         url = self.url + url
@@ -43,7 +43,8 @@ class Client(object):
         # know it's not being used as keyword argument
         password = api_key
         
-        self.url = "http:" + host + ":" + port + "/" + birdie_gateway_version
+        self.url = ("http://" + host + ":" + str(port) + "/" +
+                    birdie_gateway_version)
         
         self.client = client._construct_http_client(
             username=username,
@@ -66,7 +67,8 @@ class Client(object):
             **kwargs)
 
         # extensions
-        self.vservices = birdiegatewayservice.VServiceManager(self, self.client, self.url)
+        self.vservices = birdiegatewayservice.VServiceManager(self.client,
+                                                              self.url)
 
     def authenticate(self):
         """
@@ -0,0 +1,137 @@
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Fan-out access to many birdie gateways at once.
+
+The gateway client uses requests on plain, blocking sockets, so every
+call is run in eventlet's pool of native threads: the greenthreads of a
+sweep wait on them concurrently instead of taking turns on the hub.
+"""
+
+import eventlet
+from eventlet import greenpool
+from eventlet import tpool
+
+from birdie.birdiegatewayclient.v1 import client
+from birdie.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 32
+
+
+class GatewayTimeout(Exception):
+    """A gateway did not answer within the per-gateway timeout."""
+
+    def __init__(self, gateway, timeout):
+        self.gateway = gateway
+        self.timeout = timeout
+
+    def __str__(self):
+        return "Gateway %s did not answer within %ss" % (self.gateway,
+                                                         self.timeout)
+
+
+class MultiClient(object):
+    """
+    Send the same VServiceManager call to many gateways concurrently.
+
+    Create an instance with the gateways to talk to::
+
+        >>> mc = MultiClient([('10.0.0.1', '8899'), ('10.0.0.2', '8899')])
+
+    Then call the fan-out methods; each returns a ``(results, errors)``
+    pair keyed by ``"host:port"``, so one slow or broken gateway never
+    hides the answers of the others::
+
+        >>> results, errors = mc.list()
+
+    """
+
+    def __init__(self, gateways, concurrency=DEFAULT_CONCURRENCY,
+                 gateway_timeout=None, **kwargs):
+        """
+        :param gateways: iterable of ``(host, port)`` pairs
+        :param concurrency: maximum number of gateways queried at once
+        :param gateway_timeout: seconds to wait for each gateway, None to
+            wait forever; also the socket timeout of its requests
+        :param kwargs: extra arguments for every per-gateway
+            :class:`birdie.birdiegatewayclient.v1.client.Client`
+
+        At most EVENTLET_THREADPOOL_SIZE gateways (20 by default) are
+        actually queried at the same time, whatever the concurrency.
+        """
+        self.concurrency = concurrency
+        self.gateway_timeout = gateway_timeout
+        if gateway_timeout is not None:
+            kwargs.setdefault('timeout', gateway_timeout)
+        self.clients = {}
+        for host, port in gateways:
+            key = "%s:%s" % (host, port)
+            self.clients[key] = client.Client(host=host, port=port, **kwargs)
+
+    def _call(self, key, method, args, kwargs):
+        manager = self.clients[key].vservices
+        timeout = eventlet.Timeout(self.gateway_timeout)
+        try:
+            return tpool.execute(getattr(manager, method), *args, **kwargs)
+        except eventlet.Timeout as t:
+            if t is not timeout:
+                raise
+            raise GatewayTimeout(key, self.gateway_timeout)
+        finally:
+            timeout.cancel()
+
+    def fan_out(self, method, *args, **kwargs):
+        """Call ``vservices.<method>`` on every gateway concurrently.
+
+        :returns: tuple ``(results, errors)``; ``results`` maps each
+            gateway that answered to its response body, ``errors`` maps
+            each gateway that failed or timed out to its exception.
+        """
+        results = {}
+        errors = {}
+        pool = greenpool.GreenPool(self.concurrency)
+
+        def _run(key):
+            try:
+                return key, self._call(key, method, args, kwargs), None
+            except Exception as e:
+                return key, None, e
+
+        for key, result, error in pool.imap(_run, list(self.clients)):
+            if error is not None:
+                LOG.warn("Gateway %(gw)s failed %(method)s: %(err)s",
+                         {'gw': key, 'method': method, 'err': error})
+                errors[key] = error
+            else:
+                results[key] = result
+        return results, errors
+
+    def list(self, detailed=True, search_opts=None):
+        """List resources on every gateway.
+
+        :rtype: tuple of (dict of results, dict of errors)
+        """
+        return self.fan_out('list', detailed=detailed,
+                            search_opts=search_opts)
+
+    def get(self, id):
+        """Get one resource from every gateway.
+
+        :rtype: tuple of (dict of results, dict of errors)
+        """
+        return self.fan_out('get', id)
@@ -0,0 +1,208 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Chunked, parallel disk hashing used to verify migrated disks.
+
+A disk is cut into fixed-size chunks which are hashed independently by a
+pool of native worker threads; hashlib and file reads release the GIL,
+so they hash in parallel. The pool runs off the eventlet hub, which
+keeps serving RPC and other migrations meanwhile.
+
+The resulting ChunkManifest holds one digest per chunk plus a root
+digest over all of them, so two disks can be compared chunk by chunk
+and only the chunks that differ need copying again.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+
+from eventlet import tpool
+from oslo.config import cfg
+
+from birdie.common import log as logging
+from birdie.i18n import _
+
+checksum_opts = [
+    cfg.IntOpt('disk_hash_chunk_size',
+               default=64 * 1024 * 1024,
+               help='Size in bytes of the chunks a disk is split into when '
+                    'it is hashed'),
+    cfg.IntOpt('disk_hash_workers',
+               default=0,
+               help='Number of threads hashing disk chunks in parallel. '
+                    '0 uses one per CPU'),
+    cfg.StrOpt('disk_hash_algorithm',
+               default='sha1',
+               help='hashlib algorithm used for disk chunk digests'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(checksum_opts)
+
+LOG = logging.getLogger(__name__)
+
+READ_SIZE = 1024 * 1024
+
+
+def get_size(path):
+    """Return the size of a file or block device in bytes."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        return f.tell()
+
+
+def hash_range(path, offset, length, algorithm='sha1'):
+    """Return the hex digest of length bytes of path starting at offset."""
+    checksum = hashlib.new(algorithm)
+    pread = getattr(os, 'pread', None)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if pread is None:
+            os.lseek(fd, offset, os.SEEK_SET)
+        end = offset + length
+        while offset < end:
+            want = min(READ_SIZE, end - offset)
+            if pread is not None:
+                data = pread(fd, want, offset)
+            else:
+                data = os.read(fd, want)
+            if not data:
+                break
+            checksum.update(data)
+            offset += len(data)
+    finally:
+        os.close(fd)
+    return checksum.hexdigest()
+
+
+def _hash_chunk(args):
+    return hash_range(*args)
+
+
+class ChunkManifest(object):
+    """Per-chunk digests of a disk plus a Merkle-style root digest."""
+
+    def __init__(self, size, chunk_size, algorithm, digests, target=None):
+        """
+        :param target: optional dict describing the copy the manifest was
+            recorded for; saved and loaded with it, otherwise unused
+        """
+        self.size = size
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm
+        self.digests = list(digests)
+        self.target = target
+
+    @property
+    def digest(self):
+        """Digest over all chunk digests, identifying the whole disk.
+
+        This is not the digest of the raw disk contents; it only equals
+        the root of another manifest built with the same chunk size and
+        algorithm over identical data.
+        """
+        root = hashlib.new(self.algorithm)
+        root.update(('%d:%d:' % (self.size, self.chunk_size)).encode('ascii'))
+        for digest in self.digests:
+            root.update(digest.encode('ascii'))
+        return root.hexdigest()
+
+    def chunk_range(self, index):
+        """Return (offset, length) of chunk index."""
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    def diff(self, other):
+        """Return indexes of the chunks that differ from other.
+
+        Chunks only present in one of the manifests count as different.
+        """
+        if (self.chunk_size != other.chunk_size or
+                self.algorithm != other.algorithm):
+            raise ValueError(_('Cannot compare manifests built with '
+                               'different chunk sizes or algorithms'))
+        count = max(len(self.digests), len(other.digests))
+        return [i for i in range(count)
+                if i >= len(self.digests) or i >= len(other.digests) or
+                self.digests[i] != other.digests[i]]
+
+    def to_dict(self):
+        return {'size': self.size,
+                'chunk_size': self.chunk_size,
+                'algorithm': self.algorithm,
+                'digests': self.digests,
+                'digest': self.digest,
+                'target': self.target}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values['size'], values['chunk_size'],
+                   values['algorithm'], values['digests'],
+                   values.get('target'))
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def build_manifest(path, chunk_size=None, workers=None, algorithm=None):
+    """Hash path chunk by chunk on a pool of worker threads.
+
+    The hashing runs in eventlet's native thread pool, so the calling
+    greenthread waits without blocking the hub.
+
+    :param chunk_size: bytes per chunk, CONF.disk_hash_chunk_size by default
+    :param workers: number of worker threads, CONF.disk_hash_workers by
+        default; 1 hashes in a single thread
+    :param algorithm: hashlib algorithm, CONF.disk_hash_algorithm by default
+    :returns: :class:`ChunkManifest`
+    """
+    chunk_size = chunk_size or CONF.disk_hash_chunk_size
+    algorithm = algorithm or CONF.disk_hash_algorithm
+    if workers is None:
+        workers = CONF.disk_hash_workers
+    workers = workers or multiprocessing.cpu_count()
+
+    size = get_size(path)
+    jobs = [(path, offset, min(chunk_size, size - offset), algorithm)
+            for offset in range(0, size, chunk_size)]
+    LOG.debug("Hashing %(path)s: %(chunks)d chunks of %(chunk_size)d bytes "
+              "on %(workers)d workers",
+              {'path': path, 'chunks': len(jobs), 'chunk_size': chunk_size,
+               'workers': workers})
+
+    digests = tpool.execute(_hash_chunks, jobs, workers)
+    return ChunkManifest(size, chunk_size, algorithm, digests)
+
+
+def _hash_chunks(jobs, workers):
+    if workers == 1 or len(jobs) <= 1:
+        return [_hash_chunk(job) for job in jobs]
+    pool = multiprocessing.pool.ThreadPool(min(workers, len(jobs)))
+    try:
+        return pool.map(_hash_chunk, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,304 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Streaming compression for disk transfers.
+
+Every codec writes the stream format of its command line tool (gzip, lz4,
+zstd), so the receiving host can decompress with a plain pipe. lz4 and
+zstd are only offered when their Python bindings are installed here and
+their tool on the receiving host.
+
+AdaptiveSelector keeps, per codec, the CPU time spent and the ratio
+reached on recent chunks, together with the measured link speed. It
+picks the codec with the lowest estimated time per byte; on a fast link
+this is usually no compression at all.
+"""
+
+import threading
+import time
+import zlib
+
+from oslo.config import cfg
+
+from birdie.common import importutils
+from birdie.common import log as logging
+from birdie import exception
+from birdie.i18n import _, _LW
+
+lz4_frame = importutils.try_import('lz4.frame')
+zstandard = importutils.try_import('zstandard')
+
+compression_opts = [
+    cfg.StrOpt('disk_transfer_compression',
+               default='none',
+               help='Compression of disk data on the wire: none, auto, or '
+                    'a codec name (gzip, lz4, zstd). auto picks the codec '
+                    'per stripe from measured CPU cost and link speed'),
+    cfg.IntOpt('disk_transfer_compression_level',
+               default=1,
+               help='Compression level passed to the codec'),
+    cfg.IntOpt('disk_transfer_compression_probe_interval',
+               default=16,
+               help='With auto compression, try a codec other than the '
+                    'best one every this many selections to keep its '
+                    'figures current'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(compression_opts)
+
+LOG = logging.getLogger(__name__)
+
+# CPU time of the calling thread where available (Python 3.3+); on
+# Python 2, time.clock is the CPU time of the process.
+_cpu_time = getattr(time, 'thread_time', None) or time.clock
+
+
+class _Codec(object):
+    name = None
+    # Command reading the compressed stream on stdin on the target host.
+    decompress_cmd = None
+
+    def __init__(self, level):
+        self.level = level
+
+    def compressor(self):
+        """Return an object with compress(data) and flush() methods."""
+        raise NotImplementedError()
+
+
+class NoCodec(_Codec):
+    name = 'none'
+    decompress_cmd = 'cat'
+
+    class _Passthrough(object):
+        def compress(self, data):
+            return data
+
+        def flush(self):
+            return b''
+
+    def compressor(self):
+        return self._Passthrough()
+
+
+class GzipCodec(_Codec):
+    name = 'gzip'
+    decompress_cmd = 'gzip -dc'
+
+    def compressor(self):
+        # wbits=31 writes a gzip header and trailer around the stream.
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+
+class Lz4Codec(_Codec):
+    name = 'lz4'
+    decompress_cmd = 'lz4 -dc'
+
+    def compressor(self):
+        return _FrameCompressor(
+            lz4_frame.LZ4FrameCompressor(compression_level=self.level))
+
+
+class ZstdCodec(_Codec):
+    name = 'zstd'
+    decompress_cmd = 'zstd -dc'
+
+    def compressor(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+
+class _FrameCompressor(object):
+    """Adapts lz4's begin/compress/flush API to compress/flush."""
+
+    def __init__(self, compressor):
+        self._compressor = compressor
+        self._header = compressor.begin()
+
+    def compress(self, data):
+        out = self._header + self._compressor.compress(data)
+        self._header = b''
+        return out
+
+    def flush(self):
+        return self._header + self._compressor.flush()
+
+
+def available_codecs():
+    """Return the names of the codecs usable on this host."""
+    names = ['none', 'gzip']
+    if lz4_frame is not None:
+        names.append('lz4')
+    if zstandard is not None:
+        names.append('zstd')
+    return names
+
+
+def get_codec(name, level=None):
+    """Return the codec called name.
+
+    :raises: exception.InvalidInput if it is unknown or its library is not
+        installed
+    """
+    codecs = {'none': NoCodec, 'gzip': GzipCodec, 'lz4': Lz4Codec,
+              'zstd': ZstdCodec}
+    if name not in available_codecs():
+        raise exception.InvalidInput(
+            reason=_("Compression codec %s is not available") % name)
+    if level is None:
+        level = CONF.disk_transfer_compression_level
+    return codecs[name](level)
+
+
+class _CodecStats(object):
+    """Moving averages of one codec's cost and ratio."""
+
+    # Weight of the newest sample in the averages.
+    SMOOTHING = 0.2
+
+    def __init__(self):
+        self.samples = 0
+        self.cpu_per_byte = 0.0
+        self.ratio = 1.0
+
+    def add(self, raw, compressed, cpu_seconds):
+        if not raw:
+            return
+        cpu_per_byte = cpu_seconds / raw
+        ratio = float(compressed) / raw
+        if not self.samples:
+            self.cpu_per_byte, self.ratio = cpu_per_byte, ratio
+        else:
+            a = self.SMOOTHING
+            self.cpu_per_byte += a * (cpu_per_byte - self.cpu_per_byte)
+            self.ratio += a * (ratio - self.ratio)
+        self.samples += 1
+
+
+class AdaptiveSelector(object):
+    """Chooses a codec from observed compression cost and link speed.
+
+    Callers report every chunk with :meth:`record_chunk` and the time
+    spent sending the compressed bytes with :meth:`record_send`. The
+    estimated cost of a codec per raw byte is the CPU it takes plus its
+    output size divided by the link speed; the cheapest one wins.
+    All methods may be called from several threads at once.
+    """
+
+    def __init__(self, codecs=None, level=None, probe_interval=None):
+        names = codecs or available_codecs()
+        self.codecs = dict((name, get_codec(name, level)) for name in names)
+        self.probe_interval = (
+            probe_interval or CONF.disk_transfer_compression_probe_interval)
+        self.stats = dict((name, _CodecStats()) for name in names)
+        self.link_bps = None
+        self._selections = 0
+        self._lock = threading.Lock()
+
+    def record_chunk(self, codec, raw, compressed, cpu_seconds):
+        with self._lock:
+            self.stats[codec.name].add(raw, compressed, cpu_seconds)
+
+    def record_send(self, nbytes, seconds):
+        if seconds <= 0 or not nbytes:
+            return
+        bps = nbytes / seconds
+        with self._lock:
+            if self.link_bps is None:
+                self.link_bps = bps
+            else:
+                self.link_bps += _CodecStats.SMOOTHING * (bps -
+                                                          self.link_bps)
+
+    def _cost(self, name):
+        stats = self.stats[name]
+        link_bps = self.link_bps
+        wire = stats.ratio / link_bps if link_bps else 0.0
+        return stats.cpu_per_byte + wire
+
+    def select(self):
+        """Return the codec to use for the next stripe."""
+        with self._lock:
+            return self._select()
+
+    def _select(self):
+        self._selections += 1
+        untried = sorted(name for name, stats in self.stats.items()
+                         if not stats.samples)
+        if untried:
+            return self.codecs[untried[0]]
+        ranked = sorted(self.stats, key=self._cost)
+        if (len(ranked) > 1 and
+                self._selections % self.probe_interval == 0):
+            # Refresh a runner-up so a change in link speed or data is
+            # noticed.
+            probe = (self._selections // self.probe_interval) % (
+                len(ranked) - 1)
+            return self.codecs[ranked[1 + probe]]
+        return self.codecs[ranked[0]]
+
+
+class FixedSelector(object):
+    """Always returns the same codec; the selector for a configured one."""
+
+    def __init__(self, codec):
+        self.codec = codec
+
+    def select(self):
+        return self.codec
+
+    def record_chunk(self, codec, raw, compressed, cpu_seconds):
+        pass
+
+    def record_send(self, nbytes, seconds):
+        pass
+
+
+def get_selector(mode=None, remote_codecs=None):
+    """Return the selector for a disk_transfer_compression setting.
+
+    :param remote_codecs: names of the codecs the receiving host can
+        decompress, None if unknown. Only codecs available on both ends
+        are used; a configured codec the target lacks falls back to gzip,
+        or to no compression.
+    """
+    mode = mode or CONF.disk_transfer_compression
+    names = available_codecs()
+    if remote_codecs is not None:
+        names = [name for name in names
+                 if name == 'none' or name in remote_codecs]
+    if mode == 'auto':
+        return AdaptiveSelector(codecs=names)
+    if mode not in names:
+        # Unknown or locally missing codecs still raise in get_codec.
+        if mode in available_codecs():
+            fallback = 'gzip' if 'gzip' in names else 'none'
+            LOG.warn(_LW("Compression codec %(codec)s is not available on "
+                         "the target host, using %(fallback)s"),
+                     {'codec': mode, 'fallback': fallback})
+            mode = fallback
+    return FixedSelector(get_codec(mode))
+
+
+def compress_chunk(selector, codec, compressor, data):
+    """Compress data with compressor and report the cost to selector.
+
+    :returns: (compressed data, CPU seconds spent compressing)
+    """
+    start = _cpu_time()
+    out = compressor.compress(data)
+    seconds = _cpu_time() - start
+    selector.record_chunk(codec, len(data), len(out), seconds)
+    return out, seconds
@@ -0,0 +1,245 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Incremental disk synchronisation for V2V migrations.
+
+The first pass over a disk is a full copy. Every pass records a chunk
+hash manifest of the source under state_path; the next pass hashes the
+source again and copies only the chunks whose digests changed. The final
+cutover sync of a large VM then moves only what changed since the last
+pass.
+
+The manifest also records the destination it was copied to (path, size,
+device and inode). A pass to another or a re-created destination is a
+full copy, since that destination does not hold the earlier passes.
+
+A pass copies in batches of disk_sync_checkpoint_interval bytes and
+reports a checkpoint after each one. Given that checkpoint back, an
+interrupted pass resumes after the last batch, as long as the source
+has not changed in the meantime.
+"""
+
+import os
+import stat
+
+from oslo.config import cfg
+
+from birdie.clone.driver import blockcopy
+from birdie.clone.driver import checksum
+from birdie.common import fileutils
+from birdie.common import log as logging
+
+incremental_opts = [
+    cfg.StrOpt('disk_sync_state_dir',
+               default='$state_path/disk_sync',
+               help='Directory holding the chunk manifests of disks being '
+                    'synchronised incrementally'),
+    cfg.IntOpt('disk_sync_chunk_size',
+               default=4 * 1024 * 1024,
+               help='Granularity in bytes of change tracking between '
+                    'incremental disk syncs'),
+    cfg.IntOpt('disk_sync_checkpoint_interval',
+               default=1024 * 1024 * 1024,
+               help='Bytes of a disk copied between two checkpoints an '
+                    'interrupted sync can resume from'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(incremental_opts)
+
+LOG = logging.getLogger(__name__)
+
+
+def merge_ranges(ranges):
+    """Merge sorted, adjacent (offset, length) ranges."""
+    merged = []
+    for offset, length in ranges:
+        if merged and merged[-1][0] + merged[-1][1] == offset:
+            merged[-1] = (merged[-1][0], merged[-1][1] + length)
+        else:
+            merged.append((offset, length))
+    return merged
+
+
+def batch_ranges(ranges, start, batch_size):
+    """Yield lists of ranges past start, covering about batch_size bytes.
+
+    Ranges are clipped to start and split so that no batch holds more
+    than batch_size bytes.
+    """
+    batch = []
+    filled = 0
+    for offset, length in ranges:
+        end = offset + length
+        offset = max(offset, start)
+        while offset < end:
+            step = min(end - offset, batch_size - filled)
+            batch.append((offset, step))
+            filled += step
+            offset += step
+            if filled == batch_size:
+                yield batch
+                batch = []
+                filled = 0
+    if batch:
+        yield batch
+
+
+class IncrementalSync(object):
+    """Copies disks, transferring only chunks changed since the last pass."""
+
+    def __init__(self, state_dir=None, chunk_size=None, copier=None):
+        self.state_dir = state_dir or CONF.disk_sync_state_dir
+        self.chunk_size = chunk_size or CONF.disk_sync_chunk_size
+        self.copier = copier or blockcopy.BlockCopier()
+
+    def _manifest_path(self, disk_id):
+        return os.path.join(self.state_dir, '%s.manifest' % disk_id)
+
+    def _load_manifest(self, disk_id):
+        path = self._manifest_path(disk_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            manifest = checksum.ChunkManifest.load(path)
+        except (IOError, ValueError, KeyError):
+            LOG.warn("Ignoring unreadable sync manifest %s", path)
+            return None
+        if manifest.chunk_size != self.chunk_size:
+            return None
+        return manifest
+
+    def sync(self, disk_id, src_path, dst_path, incremental=True,
+             limiter=None, checkpoint=None, resume=None,
+             progress_callback=None):
+        """Bring dst_path up to date with src_path.
+
+        :param disk_id: stable identifier of the disk across passes
+        :param incremental: False forces a full copy
+        :param limiter: optional throttle.IOLimiter the copy is charged to
+        :param checkpoint: optional callable given a JSON serialisable
+            dict every time a batch has been synced to dst_path
+        :param resume: the last dict given to checkpoint by an interrupted
+            pass over the same disk
+        :param progress_callback: called with (done, total) bytes of the
+            pass; bytes copied before a resumed checkpoint count as done
+        :returns: dict describing the pass: mode ('full' or 'incremental'),
+            chunks, changed_chunks, resumed_from and the copier's byte
+            counters
+        """
+        new = checksum.build_manifest(src_path, chunk_size=self.chunk_size)
+        old = self._load_manifest(disk_id) if incremental else None
+        target = self._target(dst_path)
+        if old is not None and old.target != target:
+            LOG.info("Destination of disk %(disk)s changed since the last "
+                     "sync (%(old)s, now %(new)s), copying it in full",
+                     {'disk': disk_id, 'old': old.target, 'new': target})
+            old = None
+
+        if old is None or old.algorithm != new.algorithm:
+            mode = 'full'
+            changed = list(range(len(new.digests)))
+            ranges = [(0, new.size)]
+        else:
+            mode = 'incremental'
+            changed = [i for i in new.diff(old) if i < len(new.digests)]
+            ranges = merge_ranges([new.chunk_range(i) for i in changed])
+
+        if (resume and resume.get('digest') == new.digest and
+                resume.get('mode') == mode):
+            start = resume['offset']
+            target_zeroed = resume['target_zeroed']
+        else:
+            # The source changed since the checkpoint was taken, so the
+            # data copied before it may be stale: start over.
+            start = 0
+            target_zeroed = self._is_empty(dst_path)
+
+        LOG.info("Syncing disk %(disk)s (%(mode)s) from offset %(start)d: "
+                 "%(changed)d of %(chunks)d chunks changed",
+                 {'disk': disk_id, 'mode': mode, 'start': start,
+                  'changed': len(changed), 'chunks': len(new.digests)})
+
+        total = sum(length for _offset, length in ranges)
+        # What lies before the resume offset was copied by the earlier pass.
+        copied = sum(min(length, max(0, start - offset))
+                     for offset, length in ranges)
+        if progress_callback is not None:
+            progress_callback(copied, total)
+
+        stats = {}
+        for batch in batch_ranges(ranges, start,
+                                  CONF.disk_sync_checkpoint_interval):
+            batch_progress = None
+            if progress_callback is not None:
+                def batch_progress(done, _batch_total, copied=copied):
+                    progress_callback(copied + done, total)
+            batch_stats = self.copier.copy(src_path, dst_path,
+                                           target_zeroed=target_zeroed,
+                                           ranges=batch, limiter=limiter,
+                                           progress_callback=batch_progress)
+            copied += sum(length for _offset, length in batch)
+            for key, value in batch_stats.items():
+                if key != 'total':
+                    stats[key] = stats.get(key, 0) + value
+            stats['total'] = batch_stats['total']
+            if checkpoint is not None:
+                offset, length = batch[-1]
+                checkpoint({'digest': new.digest,
+                            'mode': mode,
+                            'offset': offset + length,
+                            'target_zeroed': target_zeroed})
+
+        # Only record the new state once the copy has succeeded, so a
+        # failed pass is resumed or redone against the old manifest.
+        new.target = self._target(dst_path)
+        fileutils.ensure_tree(self.state_dir)
+        new.save(self._manifest_path(disk_id))
+        return {'mode': mode,
+                'chunks': len(new.digests),
+                'changed_chunks': len(changed),
+                'resumed_from': start,
+                'stats': stats}
+
+    @staticmethod
+    def _target(path):
+        """Identify the destination a manifest was copied to, or None."""
+        path = os.path.realpath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return {'path': path,
+                'size': checksum.get_size(path),
+                'dev': st.st_dev,
+                'ino': st.st_ino,
+                'rdev': st.st_rdev}
+
+    @staticmethod
+    def _is_empty(path):
+        """Whether path is a missing or empty regular file.
+
+        Such a destination reads back zeroes wherever the copy does not
+        write, for the whole pass.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+        return stat.S_ISREG(st.st_mode) and st.st_size == 0
+
+    def reset(self, disk_id):
+        """Forget the recorded state so the next pass is a full copy."""
+        fileutils.delete_if_exists(self._manifest_path(disk_id))
@@ -0,0 +1,302 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Striped transfer of a single disk over several parallel SSH streams.
+
+The disk is split into stripes which N workers pull from a shared queue.
+Each worker holds its own connection from an ssh_utils.SSHPool and
+writes its stripes at their offsets in the remote file over SFTP. A
+stripe that fails is put back on the queue and retried, on a fresh
+connection, up to striped_transfer_retries times. Stripes can be
+compressed on the wire, see birdie.clone.driver.compression.
+
+paramiko works on plain, blocking sockets, so each stripe is sent from
+eventlet's pool of native threads; the workers themselves stay
+greenthreads, which take connections from the pool and wait for their
+stripe without holding the hub.
+"""
+
+import os
+import socket
+import time
+
+import eventlet
+from eventlet import queue as eventlet_queue
+from eventlet import tpool
+from oslo.config import cfg
+import paramiko
+from six.moves import shlex_quote
+
+from birdie.clone.driver import blockcopy
+from birdie.clone.driver import compression
+from birdie.common import log as logging
+from birdie import exception
+from birdie.i18n import _, _LW
+
+striped_opts = [
+    cfg.IntOpt('striped_transfer_streams',
+               default=4,
+               help='Number of parallel streams used to transfer one disk'),
+    cfg.IntOpt('striped_transfer_stripe_size',
+               default=64 * 1024 * 1024,
+               help='Size in bytes of the ranges a disk is split into for '
+                    'striped transfer'),
+    cfg.IntOpt('striped_transfer_retries',
+               default=3,
+               help='Number of times a failed stripe is retried'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(striped_opts)
+
+LOG = logging.getLogger(__name__)
+
+READ_SIZE = 1024 * 1024
+
+_RETRYABLE = (IOError, OSError, socket.error, EOFError, paramiko.SSHException)
+
+
+def split_ranges(extents, stripe_size):
+    """Cut (offset, length) extents into stripes of at most stripe_size."""
+    for offset, length in extents:
+        end = offset + length
+        while offset < end:
+            step = min(stripe_size, end - offset)
+            yield offset, step
+            offset += step
+
+
+class StripedTransfer(object):
+    """Sends a local disk to a remote path over parallel SSH streams.
+
+    The pool should allow at least `streams` connections to the target
+    host, and no more than EVENTLET_THREADPOOL_SIZE (20 by default)
+    streams actually run at once. Stripes are written over SFTP, or, when
+    compressed, piped through the codec's decompressor and dd on the
+    target; the codecs are limited to the tools found there.
+    """
+
+    def __init__(self, ssh_pool, streams=None, stripe_size=None,
+                 retries=None, compression_mode=None):
+        self.ssh_pool = ssh_pool
+        self.streams = streams or CONF.striped_transfer_streams
+        self.stripe_size = stripe_size or CONF.striped_transfer_stripe_size
+        self.retries = (CONF.striped_transfer_retries if retries is None
+                        else retries)
+        self.compression_mode = (compression_mode or
+                                 CONF.disk_transfer_compression)
+        self.selector = compression.get_selector(self.compression_mode)
+        self._remote_codecs = None
+
+    def _probe_codecs(self, ssh):
+        """Return the codecs whose tool is installed on the target."""
+        names = [name for name in compression.available_codecs()
+                 if name != 'none']
+        cmd = ('for c in %s; do command -v $c >/dev/null && echo $c; '
+               'done' % ' '.join(names))
+        _stdin, stdout, _stderr = ssh.exec_command(cmd)
+        found = stdout.read().decode('ascii', 'replace').split()
+        return [name for name in names if name in found]
+
+    def _prepare_remote(self, remote_path, size):
+        with self.ssh_pool.item() as ssh:
+            if (self._remote_codecs is None and
+                    self.compression_mode != 'none'):
+                self._remote_codecs = self._probe_codecs(ssh)
+                self.selector = compression.get_selector(
+                    self.compression_mode, self._remote_codecs)
+            sftp = ssh.open_sftp()
+            try:
+                sftp.open(remote_path, 'ab').close()
+                if sftp.stat(remote_path).st_size != size:
+                    sftp.truncate(remote_path, size)
+            finally:
+                sftp.close()
+
+    def _send_range(self, sftp, src_fd, remote_path, offset, length,
+                    limiter):
+        rfile = sftp.open(remote_path, 'r+b')
+        try:
+            rfile.set_pipelined(True)
+            rfile.seek(offset)
+            end = offset + length
+            while offset < end:
+                if limiter is not None:
+                    limiter.consume(min(READ_SIZE, end - offset))
+                data = blockcopy.pread(src_fd, min(READ_SIZE, end - offset),
+                                       offset)
+                if not data:
+                    raise IOError(_('Unexpected end of source at %d')
+                                  % offset)
+                rfile.write(data)
+                offset += len(data)
+        finally:
+            # Closing waits for every pipelined write to be acknowledged.
+            rfile.close()
+
+    def _send_range_compressed(self, ssh, src_fd, remote_path, offset,
+                               length, codec, limiter):
+        """Send a range through the codec's decompressor and dd.
+
+        :returns: (compressed bytes sent, wall clock seconds spent
+            compressing)
+        """
+        cmd = ('%s | dd of=%s bs=1M seek=%d oflag=seek_bytes conv=notrunc '
+               'status=none' % (codec.decompress_cmd,
+                                shlex_quote(remote_path), offset))
+        channel = ssh.get_transport().open_session()
+        sent = 0
+        compress_seconds = 0.0
+        try:
+            channel.exec_command(cmd)
+            compressor = codec.compressor()
+            end = offset + length
+            while offset < end:
+                if limiter is not None:
+                    limiter.consume(min(READ_SIZE, end - offset))
+                data = blockcopy.pread(src_fd, min(READ_SIZE, end - offset),
+                                       offset)
+                if not data:
+                    raise IOError(_('Unexpected end of source at %d')
+                                  % offset)
+                # The selector gets the CPU time; the link estimate needs
+                # the wall time, waits for the GIL included.
+                start = time.time()
+                out, _cpu_seconds = compression.compress_chunk(
+                    self.selector, codec, compressor, data)
+                compress_seconds += time.time() - start
+                channel.sendall(out)
+                sent += len(out)
+                offset += len(data)
+            out = compressor.flush()
+            channel.sendall(out)
+            sent += len(out)
+            channel.shutdown_write()
+            status = channel.recv_exit_status()
+            if status != 0:
+                raise IOError(_('Remote decompression exited with '
+                                '%(status)d: %(err)s') %
+                              {'status': status,
+                               'err': channel.makefile_stderr().read()})
+        finally:
+            channel.close()
+        return sent, compress_seconds
+
+    def _worker(self, src_fd, remote_path, stripes, stats, failed, limiter):
+        ssh = sftp = None
+        carried = False
+        try:
+            while not failed:
+                try:
+                    offset, length, attempt = stripes.get_nowait()
+                except eventlet_queue.Empty:
+                    return
+                codec = self.selector.select()
+                try:
+                    if ssh is None:
+                        ssh = self.ssh_pool.get()
+                    start = time.time()
+                    if codec.name == 'none':
+                        if sftp is None:
+                            sftp = tpool.execute(ssh.open_sftp)
+                        tpool.execute(self._send_range, sftp, src_fd,
+                                      remote_path, offset, length, limiter)
+                        sent, compress_seconds = length, 0.0
+                        self.selector.record_chunk(codec, length, length,
+                                                   0.0)
+                    else:
+                        sent, compress_seconds = tpool.execute(
+                            self._send_range_compressed, ssh, src_fd,
+                            remote_path, offset, length, codec, limiter)
+                    self.selector.record_send(
+                        sent, time.time() - start - compress_seconds)
+                    stats['bytes'] += length
+                    stats['wire_bytes'] += sent
+                    stats['stripes'] += 1
+                    stats['codecs'][codec.name] = (
+                        stats['codecs'].get(codec.name, 0) + 1)
+                    if not carried:
+                        carried = True
+                        stats['streams'] += 1
+                except _RETRYABLE as e:
+                    if sftp is not None:
+                        sftp.close()
+                        sftp = None
+                    if ssh is not None:
+                        self.ssh_pool.remove(ssh)
+                        ssh = None
+                    if attempt >= self.retries:
+                        failed.append((offset, length, e))
+                        return
+                    LOG.warn(_LW("Stripe %(offset)d+%(length)d failed "
+                                 "(attempt %(attempt)d): %(err)s"),
+                             {'offset': offset, 'length': length,
+                              'attempt': attempt + 1, 'err': e})
+                    stats['retries'] += 1
+                    stripes.put((offset, length, attempt + 1))
+        finally:
+            if sftp is not None:
+                sftp.close()
+            if ssh is not None:
+                self.ssh_pool.put(ssh)
+
+    def transfer(self, src_path, remote_path, sparse=True, limiter=None):
+        """Copy src_path to remote_path on the pool's host.
+
+        :param sparse: only send allocated extents of the source; the
+            remote file must then read back zeroes where nothing is written
+            (e.g. a new file)
+        :param limiter: optional throttle.IOLimiter shared by all streams
+        :returns: dict with bytes read, wire_bytes sent, stripes, retries,
+            the number of streams that carried data and the number of
+            stripes sent with each codec
+        :raises: exception.DiskTransferFailed if a stripe keeps failing
+        """
+        src_fd = os.open(src_path, os.O_RDONLY)
+        try:
+            size = os.lseek(src_fd, 0, os.SEEK_END)
+            self._prepare_remote(remote_path, size)
+            if sparse:
+                extents = blockcopy.iter_extents(src_fd, size)
+            else:
+                extents = [(0, size)]
+            stripes = eventlet_queue.LightQueue()
+            for offset, length in split_ranges(extents, self.stripe_size):
+                stripes.put((offset, length, 0))
+
+            stats = {'bytes': 0, 'wire_bytes': 0, 'stripes': 0,
+                     'retries': 0, 'streams': 0, 'codecs': {}}
+            failed = []
+            pool = eventlet.GreenPool(self.streams)
+            for _i in range(self.streams):
+                pool.spawn_n(self._worker, src_fd, remote_path, stripes,
+                             stats, failed, limiter)
+            pool.waitall()
+        finally:
+            os.close(src_fd)
+
+        if failed:
+            offset, length, error = failed[0]
+            raise exception.DiskTransferFailed(
+                path=src_path,
+                reason=_("stripe %(offset)d+%(length)d: %(err)s") %
+                {'offset': offset, 'length': length, 'err': error})
+        if self.streams > 1 and stats['stripes'] > 1 and stats['streams'] < 2:
+            LOG.warn(_LW("Transfer of %(src)s used a single stream out of "
+                         "%(streams)d"),
+                     {'src': src_path, 'streams': self.streams})
+        LOG.info("Transferred %(src)s to %(dst)s: %(stats)s",
+                 {'src': src_path, 'dst': remote_path, 'stats': stats})
+        return stats
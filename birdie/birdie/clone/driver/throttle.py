@@ -0,0 +1,312 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+I/O governor for concurrent migrations on one host.
+
+The host has a bandwidth and IOPS budget which is shared between the
+running migrations by weight, and shared out again whenever a migration
+starts or finishes. A migration's share is enforced in two ways: token
+buckets that the in-process copy loops draw from, and a blkio cgroup
+(keyed by utils.get_blkdev_major_minor) for external commands such as
+qemu-img or dd run with the returned cgexec prefix.
+
+Shares are computed under a plain lock; the cgroup commands are run
+after releasing it, serialised by a semaphore so that waiting for them
+yields to other greenthreads.
+"""
+
+import contextlib
+import threading
+import time
+
+import eventlet
+from eventlet import semaphore
+from oslo.config import cfg
+
+from birdie.common import log as logging
+from birdie.common import processutils
+from birdie import exception
+from birdie.i18n import _, _LW
+from birdie import utils
+
+throttle_opts = [
+    cfg.IntOpt('migration_io_host_bps',
+               default=0,
+               help='Bytes per second all migrations on this host may read '
+                    'in total. 0 means unlimited'),
+    cfg.IntOpt('migration_io_host_iops',
+               default=0,
+               help='I/O operations per second all migrations on this host '
+                    'may issue in total. 0 means unlimited'),
+    cfg.IntOpt('migration_io_min_bps',
+               default=10 * 1024 * 1024,
+               help='Lowest bandwidth in bytes per second a single '
+                    'migration is given, lowered when that many running '
+                    'migrations would exceed migration_io_host_bps'),
+    cfg.BoolOpt('migration_io_use_cgroup',
+                default=False,
+                help='Also apply migration limits through blkio cgroups to '
+                     'commands run on the migrated disks'),
+    cfg.StrOpt('migration_io_cgroup_prefix',
+               default='birdie-migration',
+               help='Prefix of the blkio cgroups created for migrations'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(throttle_opts)
+
+LOG = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Rate limiter refilled at rate tokens per second.
+
+    A rate of 0 disables limiting. Up to one second worth of tokens can
+    be saved up, which lets short bursts through at full speed.
+    """
+
+    def __init__(self, rate):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self._tokens = float(rate)
+        self._stamp = time.time()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self._tokens = min(self._tokens, float(rate))
+
+    def _refill(self):
+        now = time.time()
+        if self.rate:
+            self._tokens = min(float(self.rate),
+                               self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def consume(self, count):
+        """Take count tokens, sleeping until they are available.
+
+        Requests larger than the bucket are let through once it is full,
+        leaving it in debt, so large chunks are still paced correctly.
+        """
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return
+                self._refill()
+                needed = min(count, self.rate)
+                if self._tokens >= needed:
+                    self._tokens -= count
+                    return
+                wait = (needed - self._tokens) / float(self.rate)
+            eventlet.sleep(wait)
+
+
+class IOLimiter(object):
+    """The share of the host I/O budget given to one migration.
+
+    Copy loops call :meth:`consume` for every read or write they do.
+    cmd_prefix is set when the migration also has a blkio cgroup and
+    should be prepended to commands doing I/O for it.
+    """
+
+    def __init__(self, migration_id, paths=None, weight=1):
+        self.migration_id = migration_id
+        self.paths = list(paths or [])
+        self.weight = weight
+        self.bps = 0
+        self.iops = 0
+        self.cmd_prefix = None
+        self.devices = set()
+        self._bytes = TokenBucket(0)
+        self._ops = TokenBucket(0)
+
+    def set_limits(self, bps, iops):
+        self.bps = bps
+        self.iops = iops
+        self._bytes.set_rate(bps)
+        self._ops.set_rate(iops)
+
+    def consume(self, nbytes, ops=1):
+        self._ops.consume(ops)
+        self._bytes.consume(nbytes)
+
+
+class IOGovernor(object):
+    """Shares the host I/O budget between the running migrations.
+
+    Use :meth:`limit` around a migration's disk I/O; every migration
+    entering or leaving it triggers a rebalance of all the others.
+    """
+
+    def __init__(self, host_bps=None, host_iops=None, min_bps=None,
+                 use_cgroup=None, execute=utils.execute):
+        self.host_bps = (CONF.migration_io_host_bps if host_bps is None
+                         else host_bps)
+        self.host_iops = (CONF.migration_io_host_iops if host_iops is None
+                          else host_iops)
+        self.min_bps = (CONF.migration_io_min_bps if min_bps is None
+                        else min_bps)
+        self.use_cgroup = (CONF.migration_io_use_cgroup if use_cgroup is None
+                           else use_cgroup)
+        self._execute = execute
+        self._lock = threading.Lock()
+        self._cgroup_lock = semaphore.Semaphore()
+        self._limiters = {}
+
+    def register(self, migration_id, paths=None, weight=1):
+        """Give a migration its share of the budget.
+
+        :param paths: disks or files the migration reads and writes; only
+            used to find the block devices for the blkio cgroup
+        :param weight: relative share compared to the other migrations
+        :returns: :class:`IOLimiter`
+        """
+        limiter = IOLimiter(migration_id, paths, weight)
+        with self._lock:
+            if migration_id in self._limiters:
+                raise exception.InvalidInput(
+                    reason=_("Migration %s is already registered") %
+                    migration_id)
+            self._limiters[migration_id] = limiter
+            self._rebalance()
+        if self.use_cgroup:
+            with self._cgroup_lock:
+                self._create_cgroup(limiter)
+        self._sync_cgroups()
+        return limiter
+
+    def unregister(self, migration_id):
+        with self._lock:
+            limiter = self._limiters.pop(migration_id, None)
+            if limiter is None:
+                return
+            self._rebalance()
+        if limiter.cmd_prefix:
+            with self._cgroup_lock:
+                self._delete_cgroup(limiter)
+        self._sync_cgroups()
+
+    @contextlib.contextmanager
+    def limit(self, migration_id, paths=None, weight=1):
+        """Context manager registering a migration for its duration."""
+        limiter = self.register(migration_id, paths, weight)
+        try:
+            yield limiter
+        finally:
+            self.unregister(migration_id)
+
+    def _share(self, total, weight, total_weight, floor=0):
+        if not total:
+            return 0
+        return max(floor, int(total * weight / float(total_weight)))
+
+    def _rebalance(self):
+        if not self._limiters:
+            return
+        total_weight = sum(l.weight for l in self._limiters.values())
+        # Every migration gets its floor and the rest of the budget is
+        # shared by weight, so the floors never add up to more than the
+        # host allows.
+        floor = min(self.min_bps, self.host_bps // len(self._limiters))
+        spare = self.host_bps - floor * len(self._limiters)
+        for limiter in self._limiters.values():
+            bps = 0
+            if self.host_bps:
+                # 0 would mean unlimited.
+                bps = max(1, floor + self._share(spare, limiter.weight,
+                                                 total_weight))
+            iops = self._share(self.host_iops, limiter.weight, total_weight,
+                               1)
+            limiter.set_limits(bps, iops)
+        LOG.debug("Rebalanced I/O of %(count)d migrations: %(limits)s",
+                  {'count': len(self._limiters),
+                   'limits': dict((l.migration_id, (l.bps, l.iops))
+                                  for l in self._limiters.values())})
+
+    def _sync_cgroups(self):
+        """Apply the current limits to the cgroups, outside of _lock."""
+        with self._cgroup_lock:
+            with self._lock:
+                limiters = [l for l in self._limiters.values()
+                            if l.cmd_prefix]
+            for limiter in limiters:
+                self._update_cgroup(limiter)
+
+    def _cgroup_name(self, limiter):
+        return '%s-%s' % (CONF.migration_io_cgroup_prefix,
+                          limiter.migration_id)
+
+    def _devices(self, limiter):
+        devices = set()
+        for path in limiter.paths:
+            try:
+                device = utils.get_blkdev_major_minor(path)
+            except (exception.Error, OSError,
+                    processutils.ProcessExecutionError) as e:
+                LOG.warn(_LW("Unable to find the block device of %(path)s: "
+                             "%(err)s"), {'path': path, 'err': e})
+                continue
+            if device:
+                devices.add(device)
+        return devices
+
+    def _create_cgroup(self, limiter):
+        devices = self._devices(limiter)
+        if not devices:
+            return
+        name = self._cgroup_name(limiter)
+        try:
+            self._execute('cgcreate', '-g', 'blkio:%s' % name,
+                          run_as_root=True)
+        except processutils.ProcessExecutionError:
+            LOG.warn(_LW("Failed to create blkio cgroup %s, only in-process "
+                         "I/O will be limited"), name)
+            return
+        limiter.devices = devices
+        limiter.cmd_prefix = ['cgexec', '-g', 'blkio:%s' % name]
+
+    def _update_cgroup(self, limiter):
+        name = self._cgroup_name(limiter)
+        settings = []
+        for device in limiter.devices:
+            # 0 removes the limit for the device.
+            for kind in ('read', 'write'):
+                settings.append('blkio.throttle.%s_bps_device=%s %d' %
+                                (kind, device, limiter.bps))
+                settings.append('blkio.throttle.%s_iops_device=%s %d' %
+                                (kind, device, limiter.iops))
+        for setting in settings:
+            try:
+                self._execute('cgset', '-r', setting, name, run_as_root=True)
+            except processutils.ProcessExecutionError:
+                LOG.warn(_LW("Failed to set %(setting)s on cgroup %(name)s"),
+                         {'setting': setting, 'name': name})
+
+    def _delete_cgroup(self, limiter):
+        name = self._cgroup_name(limiter)
+        try:
+            self._execute('cgdelete', '-g', 'blkio:%s' % name,
+                          run_as_root=True)
+        except processutils.ProcessExecutionError:
+            LOG.warn(_LW("Failed to delete blkio cgroup %s"), name)
+
+    def stats(self):
+        with self._lock:
+            return dict((l.migration_id, {'bps': l.bps, 'iops': l.iops,
+                                          'weight': l.weight,
+                                          'cgroup': bool(l.cmd_prefix)})
+                        for l in self._limiters.values())
@@ -19,11 +19,19 @@
 Helper methods to deal with images.
 """
 
+import collections
+import copy
+import os
 import re
+import threading
+import time
 
 from oslo.utils import strutils
+import six
 
 from birdie.common._i18n import _
+from birdie.common import jsonutils
+from birdie.common import processutils
 
 
 class QemuImgInfo(object):
@@ -33,7 +41,27 @@ class QemuImgInfo(object):
     SIZE_RE = re.compile(r"(\d*\.?\d+)(\w+)?(\s*\(\s*(\d+)\s+bytes\s*\))?",
                          re.I)
 
-    def __init__(self, cmd_output=None):
+    def __init__(self, cmd_output=None, output_format='human'):
+        """Parse `qemu-img info` output.
+
+        Both formats give the same attributes, with the values the text
+        output shows.
+
+        :param output_format: 'human' for the default text output, or
+            'json' for `--output=json`. JSON output of `--backing-chain`
+            (a list with one entry per image) is accepted too; the first
+            entry describes the image itself and the rest end up in
+            backing_chain.
+        """
+        self.backing_chain = []
+        if output_format == 'json':
+            details = jsonutils.loads(cmd_output or '{}')
+            if isinstance(details, list):
+                chain = details or [{}]
+                details = chain[0]
+                self.backing_chain = [self._from_json(d) for d in chain[1:]]
+            self._set_json_details(details)
+            return
         details = self._parse(cmd_output or '')
         self.image = details.get('image')
         self.backing_file = details.get('backing_file')
@@ -44,6 +72,61 @@ class QemuImgInfo(object):
         self.snapshots = details.get('snapshot_list', [])
         self.encrypted = details.get('encrypted')
 
+    @classmethod
+    def _from_json(cls, details):
+        info = cls.__new__(cls)
+        info.backing_chain = []
+        info._set_json_details(details)
+        return info
+
+    def _set_json_details(self, details):
+        self.image = details.get('filename')
+        self.backing_file = details.get('full-backing-filename',
+                                        details.get('backing-filename'))
+        self.file_format = details.get('format')
+        self.virtual_size = details.get('virtual-size')
+        self.cluster_size = details.get('cluster-size')
+        # The text output shows "None", parsed as 0, where JSON leaves
+        # actual-size out.
+        self.disk_size = details.get('actual-size', 0 if details else None)
+        self.snapshots = [self._snapshot_from_json(snapshot)
+                          for snapshot in details.get('snapshots', [])]
+        self.encrypted = details.get('encrypted')
+
+    @staticmethod
+    def _human_size(size):
+        # Same as get_human_readable_size() in qemu-img.c
+        if size <= 999:
+            return '%d' % size
+        base = 1024
+        suffixes = 'KMGT'
+        for i, suffix in enumerate(suffixes):
+            if size < 10 * base:
+                return '%0.1f%s' % (float(size) / base, suffix)
+            if size < 1000 * base or i == len(suffixes) - 1:
+                return '%d%s' % ((size + (base >> 1)) // base, suffix)
+            base *= 1024
+
+    def _snapshot_from_json(self, snapshot):
+        """Return a JSON snapshot entry as _extract_details parses text."""
+        date = time.strftime('%Y-%m-%d %H:%M:%S',
+                             time.localtime(snapshot.get('date-sec', 0)))
+        clock_ns = (snapshot.get('vm-clock-sec', 0) * 10 ** 9 +
+                    snapshot.get('vm-clock-nsec', 0))
+        clock_s = clock_ns // 10 ** 9
+        vm_clock = '%02d:%02d:%02d.%03d' % (clock_s // 3600,
+                                            (clock_s // 60) % 60,
+                                            clock_s % 60,
+                                            (clock_ns // 10 ** 6) % 1000)
+        day, hour = date.split(' ')
+        # The text parser splits the date column on its space, so the
+        # time of day ends up in front of the VM clock.
+        return {'id': six.text_type(snapshot.get('id')),
+                'tag': snapshot.get('name'),
+                'vm_size': self._human_size(snapshot.get('vm-state-size', 0)),
+                'date': day,
+                'vm_clock': hour + ' ' + vm_clock}
+
     def __str__(self):
         lines = [
             'image: %s' % self.image,
@@ -101,7 +184,7 @@ class QemuImgInfo(object):
             real_details = real_details.strip().lower()
         elif root_cmd == 'snapshot_list':
             # Next line should be a header, starting with 'ID'
-            if not lines_after or not lines_after.pop(0).startswith("ID"):
+            if not lines_after or not lines_after.popleft().startswith("ID"):
                 msg = _("Snapshot list encountered but no header found!")
                 raise ValueError(msg)
             real_details = []
@@ -118,7 +201,7 @@ class QemuImgInfo(object):
                 date_pieces = line_pieces[5].split(":")
                 if len(date_pieces) != 3:
                     break
-                lines_after.pop(0)
+                lines_after.popleft()
                 real_details.append({
                     'id': line_pieces[0],
                     'tag': line_pieces[1],
@@ -134,13 +217,13 @@ class QemuImgInfo(object):
         # and then handle the results of those 'top level' items in a separate
         # function.
         #
-        # TODO(harlowja): newer versions might have a json output format
-        #                 we should switch to that whenever possible.
-        #                 see: http://bit.ly/XLJXDX
+        # NOTE: prefer output_format='json' (see qemu_img_info) where qemu-img
+        #       supports it; this parser is kept for plain text output.
         contents = {}
-        lines = [x for x in cmd_output.splitlines() if x.strip()]
+        lines = collections.deque(x for x in cmd_output.splitlines()
+                                  if x.strip())
         while lines:
-            line = lines.pop(0)
+            line = lines.popleft()
             top_level = self.TOP_LEVEL_RE.match(line)
             if top_level:
                 root = self._canonicalize(top_level.group(1))
@@ -150,3 +233,49 @@ class QemuImgInfo(object):
                 details = self._extract_details(root, root_details, lines)
                 contents[root] = details
         return contents
+
+
+_INFO_CACHE_SIZE = 256
+_info_cache = collections.OrderedDict()
+_info_cache_lock = threading.Lock()
+
+
+def qemu_img_info(path, backing_chain=False, run_as_root=False,
+                  root_helper='', execute=processutils.execute):
+    """Return a QemuImgInfo for path, parsed from `qemu-img info` JSON.
+
+    Results are cached by (path, size, mtime), so inspecting an unchanged
+    image again does not spawn qemu-img. Backing files are assumed not to
+    change underneath their children. Every call returns its own copy,
+    so callers may modify it.
+
+    :param backing_chain: also describe every backing image, see
+        QemuImgInfo.backing_chain
+    """
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime, backing_chain)
+    with _info_cache_lock:
+        info = _info_cache.pop(key, None)
+        if info is not None:
+            _info_cache[key] = info
+            return copy.deepcopy(info)
+
+    cmd = ['env', 'LC_ALL=C', 'LANG=C', 'qemu-img', 'info', '--output=json']
+    if backing_chain:
+        cmd.append('--backing-chain')
+    cmd.append(path)
+    out, _err = execute(*cmd, run_as_root=run_as_root,
+                        root_helper=root_helper)
+    info = QemuImgInfo(out, output_format='json')
+
+    with _info_cache_lock:
+        _info_cache[key] = copy.deepcopy(info)
+        while len(_info_cache) > _INFO_CACHE_SIZE:
+            _info_cache.popitem(last=False)
+    return info
+
+
+def clear_info_cache():
+    """Forget all cached qemu_img_info results."""
+    with _info_cache_lock:
+        _info_cache.clear()
@@ -17,14 +17,19 @@
 System-level utilities and helper functions.
 """
 
+import collections
 import errno
 import logging
 import multiprocessing
 import os
 import random
+import re
 import shlex
 import signal
+import time
 
+import eventlet
+from eventlet.green import os as green_os
 from eventlet.green import subprocess
 from eventlet import greenthread
 import six
@@ -82,6 +87,34 @@ def _subprocess_setup():
     signal.signal(signal.SIGPIPE, signal.SIG_DFL)
 
 
+def _subprocess_setup_group():
+    _subprocess_setup()
+    # Lead a new process group so a timeout can kill the whole pipeline.
+    os.setsid()
+
+
+# qemu-img convert -p prints "    (45.00/100%)"
+_QEMU_IMG_PROGRESS_RE = re.compile(r'\((\d+(?:\.\d+)?)/100%\)')
+# dd status=progress prints "1048576 bytes (1.0 MB, 1.0 MiB) copied, ..."
+_DD_PROGRESS_RE = re.compile(r'^\s*(\d+) bytes\b.*copied')
+
+
+def parse_progress(line, total_bytes=None):
+    """Return the completion percentage reported by a progress line.
+
+    Understands qemu-img -p output, and dd status=progress output when
+    total_bytes is known. Returns None for any other line.
+    """
+    match = _QEMU_IMG_PROGRESS_RE.search(line)
+    if match:
+        return float(match.group(1))
+    if total_bytes:
+        match = _DD_PROGRESS_RE.match(line)
+        if match:
+            return min(100.0, 100.0 * int(match.group(1)) / total_bytes)
+    return None
+
+
 def execute(*cmd, **kwargs):
     """Helper method to shell out and execute a command through subprocess.
 
@@ -213,6 +246,156 @@ def execute(*cmd, **kwargs):
             greenthread.sleep(0)
 
 
+def execute_streaming(*cmd, **kwargs):
+    """Run a long command, streaming its output instead of buffering it.
+
+    stdout and stderr are read by separate greenthreads as data arrives,
+    so this only blocks the calling greenthread; spawn it to run the
+    command in the background.
+
+    :param cmd:                Passed to subprocess.Popen.
+    :param stdout_callback:    Called with each masked stdout line.
+    :param stderr_callback:    Called with each masked stderr line.
+    :param progress_callback:  Called with a dict holding 'percent' and
+                               'elapsed' (seconds) whenever a line reports
+                               new progress, see :func:`parse_progress`.
+    :param progress_total_bytes: Size of the data being copied, needed to
+                               turn dd byte counts into percentages.
+    :param timeout:            Seconds after which the command's whole
+                               process group is killed. None waits forever.
+    :param max_retained_bytes: How much of the end of each stream to keep
+                               and return.
+    :param env_variables:      Environment for the process.
+    :param check_exit_code:    Same as for :func:`execute`.
+    :param run_as_root:        Same as for :func:`execute`.
+    :param root_helper:        Same as for :func:`execute`.
+    :param loglevel:           log level for execute commands.
+    :returns:                  (stdout, stderr) holding at most the last
+                               max_retained_bytes of each stream
+    :raises:                   :class:`UnknownArgumentError` on
+                               receiving unknown arguments
+    :raises:                   :class:`ProcessExecutionError` on a bad exit
+                               code or timeout
+    """
+    stdout_callback = kwargs.pop('stdout_callback', None)
+    stderr_callback = kwargs.pop('stderr_callback', None)
+    progress_callback = kwargs.pop('progress_callback', None)
+    progress_total_bytes = kwargs.pop('progress_total_bytes', None)
+    timeout = kwargs.pop('timeout', None)
+    max_retained_bytes = kwargs.pop('max_retained_bytes', 65536)
+    env_variables = kwargs.pop('env_variables', None)
+    check_exit_code = kwargs.pop('check_exit_code', [0])
+    ignore_exit_code = False
+    run_as_root = kwargs.pop('run_as_root', False)
+    root_helper = kwargs.pop('root_helper', '')
+    loglevel = kwargs.pop('loglevel', logging.DEBUG)
+
+    if isinstance(check_exit_code, bool):
+        ignore_exit_code = not check_exit_code
+        check_exit_code = [0]
+    elif isinstance(check_exit_code, int):
+        check_exit_code = [check_exit_code]
+
+    if kwargs:
+        raise UnknownArgumentError(_('Got unknown keyword args: %r') % kwargs)
+
+    if run_as_root and hasattr(os, 'geteuid') and os.geteuid() != 0:
+        if not root_helper:
+            raise NoRootWrapSpecified(
+                message=_('Command requested root, but did not '
+                          'specify a root helper.'))
+        cmd = shlex.split(root_helper) + list(cmd)
+
+    cmd = [str(c) for c in cmd]
+    sanitized_cmd = strutils.mask_password(' '.join(cmd))
+    LOG.log(loglevel, _('Running cmd (subprocess, streaming): %s'),
+            sanitized_cmd)
+
+    _PIPE = subprocess.PIPE  # pylint: disable=E1101
+    obj = subprocess.Popen(cmd,
+                           stdin=None,
+                           stdout=_PIPE,
+                           stderr=_PIPE,
+                           close_fds=True,
+                           preexec_fn=_subprocess_setup_group,
+                           env=env_variables)
+
+    started = time.time()
+    last_progress = [None]
+
+    def _deliver(piece, callback):
+        if callback is not None:
+            callback(piece)
+        if progress_callback is not None:
+            percent = parse_progress(piece, progress_total_bytes)
+            if percent is not None and percent != last_progress[0]:
+                last_progress[0] = percent
+                progress_callback({'percent': percent,
+                                   'elapsed': time.time() - started})
+
+    def _pump(pipe, stream, callback):
+        fd = pipe.fileno()
+        while True:
+            data = green_os.read(fd, 32768)
+            if not data:
+                break
+            for piece in stream.feed(data):
+                _deliver(piece, callback)
+        for piece in stream.flush():
+            _deliver(piece, callback)
+
+    streams = (_OutputStream(True, max_retained_bytes),
+               _OutputStream(True, max_retained_bytes))
+    readers = [greenthread.spawn(_pump, obj.stdout, streams[0],
+                                 stdout_callback),
+               greenthread.spawn(_pump, obj.stderr, streams[1],
+                                 stderr_callback)]
+
+    def _kill():
+        try:
+            os.killpg(obj.pid, signal.SIGKILL)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+        for reader in readers:
+            reader.kill()
+        obj.wait()
+
+    timer = eventlet.Timeout(timeout)
+    reaped = False
+    try:
+        for reader in readers:
+            reader.wait()
+        _returncode = obj.wait()  # pylint: disable=E1101
+        reaped = True
+    except eventlet.Timeout as t:
+        if t is not timer:
+            raise
+        timer.cancel()
+        reaped = True
+        _kill()
+        raise ProcessExecutionError(
+            stdout=streams[0].retained(),
+            stderr=streams[1].retained(),
+            cmd=sanitized_cmd,
+            description=_('Command timed out after %s seconds.') % timeout)
+    finally:
+        timer.cancel()
+        if not reaped:
+            # A callback raised, or the calling greenthread was killed:
+            # don't leave the command running unreaped.
+            _kill()
+
+    LOG.log(loglevel, 'Result was %s' % _returncode)
+    stdout, stderr = streams[0].retained(), streams[1].retained()
+    if not ignore_exit_code and _returncode not in check_exit_code:
+        raise ProcessExecutionError(exit_code=_returncode,
+                                    stdout=stdout,
+                                    stderr=stderr,
+                                    cmd=sanitized_cmd)
+    return stdout, stderr
+
+
 def trycmd(*args, **kwargs):
     """A wrapper around execute() to more easily handle warnings and errors.
 
@@ -277,6 +460,158 @@ def ssh_execute(ssh, cmd, process_input=None,
     return (sanitized_stdout, sanitized_stderr)
 
 
+# Progress meters redraw with a bare carriage return.
+_LINE_SPLIT_RE = re.compile(b'\r\n|[\r\n]')
+
+
+class _OutputStream(object):
+    """Splits raw output into masked pieces and keeps a bounded tail."""
+
+    def __init__(self, lines=True, max_retained_bytes=65536,
+                 max_line_bytes=1048576):
+        self.lines = lines
+        self.max_retained_bytes = max_retained_bytes
+        self.max_line_bytes = max_line_bytes
+        self._partial = b''
+        self._tail = collections.deque()
+        self._tail_size = 0
+
+    def _emit(self, data):
+        text = strutils.mask_password(data)
+        if self.max_retained_bytes:
+            self._tail.append(text)
+            self._tail_size += len(text)
+            while (self._tail_size > self.max_retained_bytes and
+                   len(self._tail) > 1):
+                self._tail_size -= len(self._tail.popleft())
+        return text
+
+    def feed(self, data):
+        """Return the masked pieces ready to be delivered for data."""
+        if not self.lines:
+            return [self._emit(data)]
+        data = self._partial + data
+        held = b''
+        if data.endswith(b'\r'):
+            # Might be the first half of a \r\n split across two reads.
+            data, held = data[:-1], b'\r'
+        pieces = _LINE_SPLIT_RE.split(data)
+        self._partial = pieces.pop() + held
+        if len(self._partial) > self.max_line_bytes:
+            # Don't let a never-ending line grow without bound.
+            pieces.append(self._partial[:len(self._partial) - len(held)])
+            self._partial = held
+        return [self._emit(piece) for piece in pieces]
+
+    def flush(self):
+        if not self._partial:
+            return []
+        piece, self._partial = self._partial, b''
+        if piece.endswith(b'\r'):
+            piece = piece[:-1]
+        return [self._emit(piece)]
+
+    def retained(self):
+        text = ('\n' if self.lines else '').join(self._tail)
+        if self.max_retained_bytes:
+            text = text[-self.max_retained_bytes:]
+        return text
+
+
+def _ssh_stream(ssh, cmd, streams, check_exit_code, chunk_size,
+                poll_interval):
+    sanitized_cmd = strutils.mask_password(cmd)
+    LOG.debug('Running cmd (SSH, streaming): %s', sanitized_cmd)
+
+    channel = ssh.get_transport().open_session()
+    try:
+        channel.exec_command(cmd)
+        channel.shutdown_write()
+        while True:
+            received = False
+            if channel.recv_ready():
+                received = True
+                for piece in streams[0].feed(channel.recv(chunk_size)):
+                    yield 'stdout', piece
+            if channel.recv_stderr_ready():
+                received = True
+                for piece in streams[1].feed(
+                        channel.recv_stderr(chunk_size)):
+                    yield 'stderr', piece
+            if received:
+                continue
+            # Data and EOF arrive in order on the channel, so nothing more
+            # can show up once EOF is in and both buffers are drained.
+            if channel.eof_received or channel.closed:
+                break
+            greenthread.sleep(poll_interval)
+
+        for name, stream in zip(('stdout', 'stderr'), streams):
+            for piece in stream.flush():
+                yield name, piece
+        exit_status = channel.recv_exit_status()
+    finally:
+        channel.close()
+
+    # exit_status == -1 if no exit code was returned
+    if exit_status != -1:
+        LOG.debug('Result was %s' % exit_status)
+        if check_exit_code and exit_status != 0:
+            raise ProcessExecutionError(exit_code=exit_status,
+                                        stdout=streams[0].retained(),
+                                        stderr=streams[1].retained(),
+                                        cmd=sanitized_cmd)
+
+
+def ssh_execute_iter(ssh, cmd, check_exit_code=True, lines=True,
+                     chunk_size=32768, max_retained_bytes=65536,
+                     poll_interval=0.1):
+    """Run cmd over SSH and yield its output as it arrives.
+
+    stdout and stderr are read from the same channel as data becomes
+    ready, so a chatty stderr can never block the command.
+
+    :param lines:              True to yield whole lines, False to yield
+                               raw chunks as received.
+    :param max_retained_bytes: how much of the end of each stream to keep
+                               for the ProcessExecutionError raised on a
+                               bad exit code.
+    :returns:                  generator of ('stdout' | 'stderr', text)
+                               pairs, passwords masked.
+    :raises:                   :class:`ProcessExecutionError`
+    """
+    streams = (_OutputStream(lines, max_retained_bytes),
+               _OutputStream(lines, max_retained_bytes))
+    for item in _ssh_stream(ssh, cmd, streams, check_exit_code, chunk_size,
+                            poll_interval):
+        yield item
+
+
+def ssh_execute_streaming(ssh, cmd, stdout_callback=None,
+                          stderr_callback=None, check_exit_code=True,
+                          lines=True, chunk_size=32768,
+                          max_retained_bytes=65536, poll_interval=0.1):
+    """Run cmd over SSH, handing output to callbacks as it arrives.
+
+    Unlike ssh_execute(), memory use is bounded by max_retained_bytes per
+    stream however much the command prints.
+
+    :param stdout_callback: called with each masked stdout line or chunk.
+    :param stderr_callback: called with each masked stderr line or chunk.
+    :returns:               (stdout, stderr) holding at most the last
+                            max_retained_bytes of each stream.
+    :raises:                :class:`ProcessExecutionError`
+    """
+    streams = (_OutputStream(lines, max_retained_bytes),
+               _OutputStream(lines, max_retained_bytes))
+    callbacks = {'stdout': stdout_callback, 'stderr': stderr_callback}
+    for name, piece in _ssh_stream(ssh, cmd, streams, check_exit_code,
+                                   chunk_size, poll_interval):
+        if callbacks[name] is not None:
+            callbacks[name](piece)
+    return streams[0].retained(), streams[1].retained()
+
+
 def get_worker_count():
     """Utility to get the default worker count.
 
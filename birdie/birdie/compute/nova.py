@@ -16,7 +16,10 @@
 Handles all requests to Nova.
 """
 
+import hashlib
 
+from eventlet import greenpool
+from eventlet import tpool
 from novaclient import exceptions as nova_exceptions
 from novaclient import extension
 from novaclient import service_catalog
@@ -25,11 +28,13 @@ from novaclient.v1_1.contrib import assisted_volume_snapshots
 from novaclient.v1_1.contrib import list_extensions
 from oslo.config import cfg
 from requests import exceptions as request_exceptions
+import six
 
 from birdie.common import log as logging
 from birdie import context as ctx
 
 from birdie import exception
+from birdie import utils
 
 nova_opts = [
     cfg.StrOpt('nova_catalog_info',
@@ -58,6 +63,25 @@ nova_opts = [
     cfg.BoolOpt('nova_api_insecure',
                 default=False,
                 help='Allow to perform insecure SSL requests to nova'),
+    cfg.IntOpt('nova_client_cache_size',
+               default=128,
+               help='Maximum number of nova clients kept for reuse across '
+                    'requests. 0 disables the cache'),
+    cfg.IntOpt('nova_client_cache_ttl',
+               default=600,
+               help='Seconds a cached nova client is reused; entries are '
+                    'also dropped shortly before their auth token expires'),
+    cfg.IntOpt('nova_bulk_get_concurrency',
+               default=10,
+               help='Maximum number of concurrent requests sent to nova '
+                    'when looking up a set of servers'),
+    cfg.IntOpt('nova_bulk_list_threshold',
+               default=50,
+               help='When looking up more servers than this, page through '
+                    'the server list instead of fetching each server'),
+    cfg.IntOpt('nova_list_page_size',
+               default=500,
+               help='Number of servers requested from nova per page'),
 ]
 
 CONF = cfg.CONF
@@ -68,6 +92,29 @@ LOG = logging.getLogger(__name__)
 nova_extensions = (assisted_volume_snapshots,
                    extension.Extension('list_extensions', list_extensions))
 
+_CLIENT_CACHE = None
+
+
+def reset_globals():
+    """Testing method to reset globals.
+    """
+    global _CLIENT_CACHE
+    _CLIENT_CACHE = None
+
+
+def _get_client_cache():
+    global _CLIENT_CACHE
+    if _CLIENT_CACHE is None:
+        _CLIENT_CACHE = utils.ExpiringLRUCache(CONF.nova_client_cache_size,
+                                               CONF.nova_client_cache_ttl)
+    return _CLIENT_CACHE
+
+
+def _token_hash(token):
+    if isinstance(token, six.text_type):
+        token = token.encode('utf-8')
+    return hashlib.sha1(token or b'').hexdigest()
+
 
 def novaclient(context, admin_endpoint=False, privileged_user=False,
                timeout=None):
@@ -80,7 +127,27 @@ def novaclient(context, admin_endpoint=False, privileged_user=False,
         'os_privileged_user_tenant' to be set)
     @param timeout: Number of seconds to wait for an answer before raising a
         Timeout exception (None to disable)
+
+    Clients are cached per user, project, endpoint and privilege, so
+    repeated calls reuse the authenticated client and its connections.
     """
+    privileged = bool(privileged_user and CONF.os_privileged_user_name)
+    # The privileged client authenticates itself and re-authenticates on
+    # expiry, so only user clients are tied to the caller's token.
+    if privileged:
+        key = (CONF.os_privileged_user_name, CONF.os_privileged_user_tenant,
+               admin_endpoint, timeout, True)
+        ttl = CONF.nova_client_cache_ttl
+    else:
+        key = (context.user_id, context.project_id, admin_endpoint, timeout,
+               False, _token_hash(context.auth_token))
+        ttl = utils.token_cache_ttl(context, CONF.nova_client_cache_ttl)
+
+    cache = _get_client_cache()
+    c = cache.get(key)
+    if c is not None:
+        return c
+
     # FIXME: the novaclient ServiceCatalog object is mis-named.
     #        It actually contains the entire access blob.
     # Only needed parts of the service catalog are passed in, see
@@ -148,6 +215,7 @@ def novaclient(context, admin_endpoint=False, privileged_user=False,
         c.client.auth_token = (context.auth_token or '%s:%s'
                                % (context.user_id, context.project_id))
         c.client.management_url = url
+    cache.set(key, c, ttl=ttl)
     return c
 
 
@@ -187,3 +255,76 @@ class API(object):
                               timeout=timeout).servers.list()
         except request_exceptions.Timeout:
             raise exception.APITimeout(service='Nova')
+
+    def get_servers(self, context, ids, fields=None, search_opts=None,
+                    privileged_user=False, timeout=None):
+        """Look up many servers at once.
+
+        Small sets are fetched with concurrent GETs; larger ones by paging
+        through the detailed server list with search_opts applied by nova,
+        stopping as soon as every requested server has been seen.
+
+        :param ids: iterable of server UUIDs
+        :param fields: if given, return dicts holding only these attributes
+            instead of novaclient Server objects
+        :param search_opts: extra server-side filters for the list path,
+            e.g. {'all_tenants': 1, 'host': 'compute1'}
+        :returns: tuple (dict of UUID to server, list of missing UUIDs)
+        """
+        wanted = set(ids)
+        LOG.debug("Nova client query %d servers start", len(wanted))
+        client = novaclient(context, privileged_user=privileged_user,
+                            timeout=timeout)
+        try:
+            if len(wanted) <= CONF.nova_bulk_list_threshold:
+                found = self._get_servers_concurrently(client, wanted)
+            else:
+                found = self._get_servers_by_listing(client, wanted,
+                                                     search_opts)
+        except request_exceptions.Timeout:
+            raise exception.APITimeout(service='Nova')
+
+        if fields is not None:
+            found = dict((uuid, dict((f, getattr(server, f, None))
+                                     for f in fields))
+                         for uuid, server in found.items())
+        missing = [uuid for uuid in wanted if uuid not in found]
+        LOG.debug("Nova client query servers end, %(found)d found, "
+                  "%(missing)d missing",
+                  {'found': len(found), 'missing': len(missing)})
+        return found, missing
+
+    def _get_servers_concurrently(self, client, wanted):
+        # novaclient does its HTTP on blocking sockets, so the GETs run in
+        # eventlet's native thread pool to actually overlap.
+        def _get(server_id):
+            try:
+                return server_id, tpool.execute(client.servers.get,
+                                                server_id)
+            except nova_exceptions.NotFound:
+                return server_id, None
+
+        pool = greenpool.GreenPool(CONF.nova_bulk_get_concurrency)
+        return dict((server_id, server)
+                    for server_id, server in pool.imap(_get, wanted)
+                    if server is not None)
+
+    def _get_servers_by_listing(self, client, wanted, search_opts):
+        # Pages follow each other by marker, so they cannot overlap; each
+        # one is still fetched in the native thread pool so the hub keeps
+        # serving other requests meanwhile. The uuid filter is admin only
+        # in nova, which is why wanted is not sent server-side.
+        found = {}
+        marker = None
+        page_size = CONF.nova_list_page_size
+        while len(found) < len(wanted):
+            page = tpool.execute(client.servers.list, detailed=True,
+                                 search_opts=search_opts, marker=marker,
+                                 limit=page_size)
+            for server in page:
+                if server.id in wanted:
+                    found[server.id] = server
+            if len(page) < page_size:
+                break
+            marker = page[-1].id
+        return found
@@ -47,7 +47,8 @@ class RequestContext(object):
                  roles=None, remote_address=None, timestamp=None,
                  request_id=None, auth_token=None, overwrite=True,
                  quota_class=None, user_name=None, project_name=None,
-                 service_catalog=None, instance_lock_checked=False, **kwargs):
+                 service_catalog=None, instance_lock_checked=False,
+                 auth_token_expires=None, **kwargs):
         """:param read_deleted: 'no' indicates deleted records are hidden,
                 'yes' indicates deleted records are visible,
                 'only' indicates that *only* deleted records are visible.
@@ -56,6 +57,9 @@ class RequestContext(object):
            :param overwrite: Set to False to ensure that the greenthread local
                 copy of the index is not overwritten.
 
+           :param auth_token_expires: Expiry time of auth_token, as a
+                datetime or an ISO 8601 string, if known.
+
            :param kwargs: Extra arguments that might be present, but we ignore
                 because they possibly came in from older rpc messages.
         """
@@ -77,6 +81,10 @@ class RequestContext(object):
             request_id = generate_request_id()
         self.request_id = request_id
         self.auth_token = auth_token
+        if isinstance(auth_token_expires, six.string_types):
+            auth_token_expires = timeutils.normalize_time(
+                timeutils.parse_isotime(auth_token_expires))
+        self.auth_token_expires = auth_token_expires
 
         if service_catalog:
             # Only include required parts of service_catalog
@@ -126,6 +134,9 @@ class RequestContext(object):
                 'timestamp': timeutils.strtime(self.timestamp),
                 'request_id': self.request_id,
                 'auth_token': self.auth_token,
+                'auth_token_expires': (self.auth_token_expires and
+                                       timeutils.isotime(
+                                           self.auth_token_expires)),
                 'quota_class': self.quota_class,
                 'user_name': self.user_name,
                 'service_catalog': self.service_catalog,
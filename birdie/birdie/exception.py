@@ -217,6 +217,22 @@ class NoMoreTargets(V2vException):
     pass
 
 
+class DiskTransferFailed(V2vException):
+    message = _("Transfer of disk %(path)s failed: %(reason)s")
+
+
+class MigrationNotFound(NotFound):
+    message = _("Migration %(migration_id)s could not be found.")
+
+
+class MigrationFailed(V2vException):
+    message = _("Migration %(migration_id)s failed: %(reason)s")
+
+
+class MigrationCancelled(V2vException):
+    message = _("Migration %(migration_id)s was cancelled.")
+
+
 class QuotaError(V2vException):
     message = _("Quota exceeded: code=%(code)s")
     code = 413
@@ -105,6 +105,15 @@ class Manager(periodic_task.PeriodicTasks):
         """
         pass
 
+    def cleanup_host(self):
+        """A hook for service to stop the work of the manager.
+
+        Called by the service when it is stopped, after it stopped taking
+        RPC calls. Child classes should override this method.
+
+        """
+        pass
+
     def service_version(self, context):
         return version.version_string()
 
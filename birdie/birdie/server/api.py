@@ -29,11 +29,32 @@ class MigrationAPI(object):
         
     
     
-    def get_all(self, context):
+    def get_all(self, context, sort_key=None, sort_dir='asc', after=None,
+                limit=None):
         
         LOG.debug("migration api start")
         host = CONF.host
-        self.migration_rpcapi.get_all(context, host)
+        return self.migration_rpcapi.get_all(context, host,
+                                             sort_key=sort_key,
+                                             sort_dir=sort_dir, after=after,
+                                             limit=limit)
+
+    def create_migration(self, context, spec, source_host=None, priority=0):
+        return self.migration_rpcapi.create_migration(
+            context, CONF.host, spec, source_host=source_host,
+            priority=priority)
+
+    def get_migration(self, context, migration_id):
+        return self.migration_rpcapi.get_migration(context, CONF.host,
+                                                   migration_id)
+
+    def get_migration_progress(self, context, migration_id):
+        return self.migration_rpcapi.get_migration_progress(
+            context, CONF.host, migration_id)
+
+    def cancel_migration(self, context, migration_id):
+        return self.migration_rpcapi.cancel_migration(context, CONF.host,
+                                                      migration_id)
         
         
     
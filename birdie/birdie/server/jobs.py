@@ -0,0 +1,520 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Migration job engine run by the MigrationManager.
+
+Jobs wait in a priority queue and run on a ThreadGroup, with both a
+global limit and a per-host limit on how many run at the same time.
+Every job goes through the PHASES in order; the work of each phase is
+done by the task driver (migration_task_driver). Cancellation is checked
+between phases and between disks. Phases run in greenthreads, so the
+blocking parts (copy loops, hashing) yield or use eventlet.tpool.
+
+With a jobstore.JobStore, jobs are saved at every change of state and
+unfinished ones are queued again by :meth:`MigrationEngine.resume` after
+a restart. Their phases run again from prepare, but disk copies resume
+from their last checkpoint.
+"""
+
+import bisect
+import heapq
+import itertools
+import os
+import uuid
+
+from eventlet import greenthread
+from eventlet import tpool
+from oslo.config import cfg
+import six
+
+from birdie.clone.driver import checksum
+from birdie.common import log as logging
+from birdie.common import processutils
+from birdie.common import threadgroup
+from birdie.common import timeutils
+from birdie import exception
+from birdie.i18n import _, _LE, _LI, _LW
+from birdie.server import telemetry
+from birdie import utils
+
+jobs_opts = [
+    cfg.IntOpt('migration_max_concurrent',
+               default=64,
+               help='Maximum number of migration jobs a manager runs at '
+                    'the same time'),
+    cfg.IntOpt('migration_max_per_host',
+               default=8,
+               help='Maximum number of migration jobs running at the same '
+                    'time against one source host'),
+    cfg.IntOpt('migration_copy_retries',
+               default=2,
+               help='Number of times the copy of a disk is resumed from its '
+                    'last checkpoint after an I/O error'),
+    cfg.IntOpt('migration_finished_jobs_kept',
+               default=1000,
+               help='Number of finished migration jobs kept for queries'),
+    cfg.StrOpt('migration_task_driver',
+               default='birdie.server.jobs.MigrationTask',
+               help='Class doing the work of each migration phase'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(jobs_opts)
+
+LOG = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+PREPARE = 'prepare'
+COPY = 'copy'
+CONVERT = 'convert'
+BOOT = 'boot'
+VERIFY = 'verify'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+PHASES = (PREPARE, COPY, CONVERT, BOOT, VERIFY)
+FINAL_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+class MigrationJob(object):
+    """One migration and where it is at.
+
+    spec is the request as given by the caller; it must at least hold a
+    'disks' list, see :class:`MigrationTask`. Task drivers may keep
+    anything they need between phases in context.
+    """
+
+    def __init__(self, spec, host=None, priority=0, job_id=None):
+        self.id = job_id or str(uuid.uuid4())
+        self.spec = spec
+        self.host = host or spec.get('host') or CONF.host
+        self.priority = priority
+        self.state = QUEUED
+        self.error = None
+        self.created_at = timeutils.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.context = {}
+        self.metrics = telemetry.JobMetrics()
+
+    @property
+    def finished(self):
+        return self.state in FINAL_STATES
+
+    def check_cancelled(self):
+        if self.cancel_requested:
+            raise exception.MigrationCancelled(migration_id=self.id)
+
+    def to_dict(self):
+        def _time(at):
+            return timeutils.isotime(at) if at else None
+
+        return {'id': self.id,
+                'host': self.host,
+                'priority': self.priority,
+                'state': self.state,
+                'error': self.error,
+                'spec': self.spec,
+                'created_at': _time(self.created_at),
+                'started_at': _time(self.started_at),
+                'finished_at': _time(self.finished_at)}
+
+    def progress(self):
+        """Return the job's state with its telemetry.JobMetrics figures."""
+        progress = self.metrics.to_dict()
+        progress.update({'id': self.id, 'host': self.host,
+                         'state': self.state})
+        return progress
+
+    @classmethod
+    def from_dict(cls, values):
+        """Rebuild a stored job; it is queued again from the start."""
+        job = cls(values['spec'], host=values['host'],
+                  priority=values['priority'], job_id=values['id'])
+        job.created_at = timeutils.normalize_time(
+            timeutils.parse_isotime(values['created_at']))
+        return job
+
+
+class MigrationTask(object):
+    """Default task driver, migrating local disks.
+
+    The job spec holds a 'disks' list of dicts with:
+
+    * id: stable identifier of the disk, keys its incremental sync state
+    * src, dst: source and destination paths
+    * format: optional; dst is then converted with qemu-img into
+      'converted' (dst plus the format as extension by default)
+
+    It may also hold:
+
+    * incremental: False to copy every disk in full, see
+      incremental.IncrementalSync
+    * sync_only: True for a sync pass of a live source ahead of the
+      cutover; such a job only copies, since the source keeps changing
+      and could not be verified
+
+    Booting depends on the target cloud, so the boot phase does nothing
+    here; drivers for a cloud override it.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def prepare(self, job):
+        disks = job.spec.get('disks') or []
+        if not disks:
+            raise exception.InvalidInput(reason=_("No disks to migrate"))
+        for disk in disks:
+            if not os.path.exists(disk['src']):
+                raise exception.FileNotFound(file_path=disk['src'])
+            job.metrics.set_disk_total(disk['id'],
+                                       checksum.get_size(disk['src']))
+        paths = [disk['src'] for disk in disks] + [disk['dst']
+                                                  for disk in disks]
+        job.context['limiter'] = self.manager.io_governor.register(
+            job.id, paths, weight=max(1, job.priority))
+
+    def copy(self, job):
+        store = self.manager.job_store
+        checkpoints = store.get_checkpoints(job.id)
+        for disk in job.spec['disks']:
+            job.check_cancelled()
+            resume = checkpoints.get(disk['id'])
+            if resume and resume.get('done'):
+                continue
+
+            def save(state, disk_id=disk['id']):
+                store.save_checkpoint(job.id, disk_id, state)
+                # The batch is safely on disk: a good point to stop at.
+                job.check_cancelled()
+
+            def progress(done, total, disk_id=disk['id']):
+                job.metrics.disk_progress(disk_id, done, total)
+
+            attempt = 0
+            while True:
+                try:
+                    self.manager._sync_disk(
+                        disk['id'], disk['src'], disk['dst'],
+                        incremental=job.spec.get('incremental', True),
+                        limiter=job.context.get('limiter'),
+                        checkpoint=save, resume=resume,
+                        progress_callback=progress)
+                    break
+                except (IOError, OSError) as e:
+                    if attempt >= CONF.migration_copy_retries:
+                        raise
+                    attempt += 1
+                    job.metrics.add_retry()
+                    LOG.warn(_LW("Copy of disk %(disk)s of migration %(id)s "
+                                 "failed, resuming (attempt %(attempt)d): "
+                                 "%(err)s"),
+                             {'disk': disk['id'], 'id': job.id,
+                              'attempt': attempt, 'err': e})
+                    resume = store.get_checkpoints(job.id).get(disk['id'])
+            store.save_checkpoint(job.id, disk['id'], {'done': True})
+
+    def convert(self, job):
+        limiter = job.context.get('limiter')
+        prefix = (limiter and limiter.cmd_prefix) or []
+        kwargs = {}
+        if prefix:
+            # The blkio cgroup is root's; only root may run cgexec in it.
+            kwargs = {'run_as_root': True,
+                      'root_helper': utils.get_root_helper()}
+        disks = [disk for disk in job.spec['disks'] if disk.get('format')]
+        for index, disk in enumerate(disks):
+            job.check_cancelled()
+            target = disk.setdefault('converted',
+                                     '%s.%s' % (disk['dst'], disk['format']))
+            cmd = prefix + ['qemu-img', 'convert', '-p', '-O',
+                            disk['format'], disk['dst'], target]
+
+            def progress(values, index=index):
+                # Spread the disks evenly over the phase.
+                job.metrics.phase_progress(
+                    (index * 100.0 + values['percent']) / len(disks))
+
+            processutils.execute_streaming(*cmd, progress_callback=progress,
+                                           **kwargs)
+
+    def boot(self, job):
+        pass
+
+    def verify(self, job):
+        if job.spec.get('sync_only'):
+            return
+        for disk in job.spec['disks']:
+            if disk.get('format'):
+                # The converted image no longer matches the source
+                # byte for byte.
+                continue
+            job.check_cancelled()
+            mismatched = self._compare(disk['src'], disk['dst'])
+            if mismatched:
+                raise exception.MigrationFailed(
+                    migration_id=job.id,
+                    reason=_("%(count)d chunks of disk %(disk)s differ "
+                             "from the source") %
+                    {'count': len(mismatched), 'disk': disk['id']})
+
+    def _compare(self, src_path, dst_path):
+        src = checksum.build_manifest(src_path)
+        if checksum.get_size(dst_path) == src.size:
+            dst = checksum.build_manifest(dst_path, chunk_size=src.chunk_size,
+                                          algorithm=src.algorithm)
+            return src.diff(dst)
+        # A block device destination may be larger than the source; only
+        # the part the source covers is compared.
+        return [i for i, digest in enumerate(src.digests)
+                if tpool.execute(checksum.hash_range, dst_path,
+                                 *src.chunk_range(i),
+                                 algorithm=src.algorithm) != digest]
+
+    def cleanup(self, job):
+        """Release what prepare took; runs however the job ended."""
+        if 'limiter' in job.context:
+            self.manager.io_governor.unregister(job.id)
+            del job.context['limiter']
+
+
+class MigrationEngine(object):
+    """Queues migration jobs and runs them within the concurrency limits.
+
+    :param task: task driver doing the work of each phase
+    :param running_by_host: dict of host to the set of ids of jobs
+        running against it, shared with the owner
+    :param store: optional jobstore.JobStore the jobs are persisted in
+    """
+
+    def __init__(self, task, max_concurrent=None, max_per_host=None,
+                 running_by_host=None, store=None):
+        self.task = task
+        self.store = store
+        self.max_concurrent = max_concurrent or CONF.migration_max_concurrent
+        self.max_per_host = max_per_host or CONF.migration_max_per_host
+        self.running_by_host = ({} if running_by_host is None
+                                else running_by_host)
+        self.jobs = {}
+        # sort_key -> sorted positions of the jobs, see _position; built
+        # by the first page sorted on that key and kept up to date since.
+        self._indexes = {}
+        # job id -> sort_key -> position of the job in that index
+        self._indexed = {}
+        self._queue = []
+        self._counter = itertools.count()
+        self._stopping = False
+        self.tg = threadgroup.ThreadGroup(self.max_concurrent)
+
+    def submit(self, spec, host=None, priority=0):
+        """Queue a migration; higher priorities are started first."""
+        job = MigrationJob(spec, host=host, priority=priority)
+        self._save(job)
+        self._enqueue(job)
+        LOG.info(_LI("Queued migration %(id)s from %(host)s"),
+                 {'id': job.id, 'host': job.host})
+        self._dispatch()
+        return job
+
+    def resume(self):
+        """Queue again the unfinished jobs found in the store.
+
+        :returns: number of jobs resumed
+        """
+        if self.store is None:
+            return 0
+        count = 0
+        for values in self.store.get_jobs(exclude_states=FINAL_STATES):
+            job = MigrationJob.from_dict(values)
+            if job.id in self.jobs:
+                continue
+            LOG.info(_LI("Resuming migration %(id)s, interrupted in "
+                         "%(state)s"),
+                     {'id': job.id, 'state': values['state']})
+            self._enqueue(job)
+            count += 1
+        self._dispatch()
+        return count
+
+    def _enqueue(self, job):
+        self.jobs[job.id] = job
+        self._reindex(job)
+        heapq.heappush(self._queue,
+                       (-job.priority, next(self._counter), job))
+
+    def _save(self, job):
+        self._reindex(job)
+        if self.store is not None:
+            self.store.save_job(job.to_dict())
+
+    @staticmethod
+    def _position(values, sort_key):
+        # Unset values, such as finished_at, sort first.
+        value = values.get(sort_key)
+        return (value is not None, value, values['id'])
+
+    def _unindex(self, job_id):
+        for sort_key, position in self._indexed.pop(job_id, {}).items():
+            index = self._indexes[sort_key]
+            del index[bisect.bisect_left(index, position)]
+
+    def _reindex(self, job):
+        """Move the job to its current place in every sort index."""
+        if not self._indexes:
+            return
+        self._unindex(job.id)
+        values = job.to_dict()
+        positions = self._indexed[job.id] = {}
+        for sort_key, index in self._indexes.items():
+            position = self._position(values, sort_key)
+            bisect.insort(index, position)
+            positions[sort_key] = position
+
+    def get(self, job_id):
+        try:
+            return self.jobs[job_id]
+        except KeyError:
+            raise exception.MigrationNotFound(migration_id=job_id)
+
+    def list(self):
+        return sorted(self.jobs.values(), key=lambda job: job.created_at)
+
+    def page(self, sort_key='created_at', sort_dir='asc', after=None,
+             limit=None):
+        """Return up to limit jobs as dicts, ordered by (sort_key, id).
+
+        :param after: (value, id) of the last job of the previous page;
+            only jobs sorting after it are returned
+        """
+        index = self._indexes.get(sort_key)
+        if index is None:
+            index = self._indexes[sort_key] = []
+            for job in self.jobs.values():
+                position = self._position(job.to_dict(), sort_key)
+                index.append(position)
+                self._indexed.setdefault(job.id, {})[sort_key] = position
+            index.sort()
+
+        if sort_dir == 'desc':
+            end = len(index)
+            if after is not None:
+                end = bisect.bisect_left(
+                    index, (after[0] is not None, after[0], after[1]))
+            start = 0 if limit is None else max(0, end - limit)
+            positions = reversed(index[start:end])
+        else:
+            start = 0
+            if after is not None:
+                start = bisect.bisect_right(
+                    index, (after[0] is not None, after[0], after[1]))
+            end = None if limit is None else start + limit
+            positions = index[start:end]
+        return [self.jobs[position[2]].to_dict() for position in positions]
+
+    def cancel(self, job_id):
+        """Cancel a job; a running one stops at its next checkpoint."""
+        job = self.get(job_id)
+        if job.finished:
+            return job
+        job.cancel_requested = True
+        if job.state == QUEUED:
+            # Left in the heap, _dispatch skips it.
+            job.state = CANCELLED
+            job.finished_at = timeutils.utcnow()
+            self._save(job)
+        return job
+
+    def running_count(self):
+        return sum(len(ids) for ids in self.running_by_host.values())
+
+    def _dispatch(self):
+        if self._stopping:
+            return
+        blocked = []
+        while self._queue and self.running_count() < self.max_concurrent:
+            entry = heapq.heappop(self._queue)
+            job = entry[2]
+            if job.state != QUEUED:
+                continue
+            running = self.running_by_host.setdefault(job.host, set())
+            if len(running) >= self.max_per_host:
+                blocked.append(entry)
+                continue
+            running.add(job.id)
+            self.tg.add_thread(self._run, job)
+        for entry in blocked:
+            heapq.heappush(self._queue, entry)
+
+    def _run(self, job):
+        job.started_at = timeutils.utcnow()
+        try:
+            for phase in PHASES:
+                job.check_cancelled()
+                job.state = phase
+                job.metrics.start_phase(phase)
+                self._save(job)
+                LOG.debug("Migration %(id)s entering %(phase)s",
+                          {'id': job.id, 'phase': phase})
+                getattr(self.task, phase)(job)
+            job.state = COMPLETED
+            LOG.info(_LI("Migration %s completed"), job.id)
+        except exception.MigrationCancelled:
+            job.state = CANCELLED
+            LOG.info(_LI("Migration %s cancelled"), job.id)
+        except Exception as e:
+            LOG.exception(_LE("Migration %(id)s failed in %(phase)s"),
+                          {'id': job.id, 'phase': job.state})
+            job.error = six.text_type(e)
+            job.state = FAILED
+        finally:
+            job.metrics.end_phase()
+            try:
+                self.task.cleanup(job)
+            except Exception:
+                LOG.exception(_LE("Cleanup of migration %s failed"), job.id)
+            # Anything else, such as the GreenletExit of stop(), leaves the
+            # job unfinished, to be resumed from its checkpoints.
+            if job.finished:
+                job.finished_at = timeutils.utcnow()
+            self._save(job)
+            if job.finished and self.store is not None:
+                self.store.clear_checkpoints(job.id)
+            self.running_by_host[job.host].discard(job.id)
+            self._forget_finished()
+            # This greenthread still holds its slot of the pool, and
+            # add_thread would wait for it on a full pool.
+            greenthread.spawn_n(self._dispatch)
+
+    def _forget_finished(self):
+        finished = sorted((job for job in self.jobs.values() if job.finished),
+                          key=lambda job: job.finished_at)
+        excess = len(finished) - CONF.migration_finished_jobs_kept
+        for job in finished[:max(0, excess)]:
+            del self.jobs[job.id]
+            self._unindex(job.id)
+            if self.store is not None:
+                self.store.delete_job(job.id)
+
+    def stop(self, graceful=False):
+        """Stop the running jobs and start no more.
+
+        Unless graceful, running jobs are killed where they are and are
+        resumed from their checkpoints by the next :meth:`resume`.
+        """
+        self._stopping = True
+        self.tg.stop(graceful)
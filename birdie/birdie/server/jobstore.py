@@ -0,0 +1,109 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Local persistence of migration jobs and their copy checkpoints.
+
+The MigrationManager keeps its jobs in a SQLite file under state_path,
+so that unfinished jobs can be picked up again after a restart. Copies
+record a checkpoint per disk every time a batch of data has been synced
+to the destination; a resumed job continues from there.
+"""
+
+import os
+import sqlite3
+
+from oslo.config import cfg
+
+from birdie.common import fileutils
+from birdie.common import jsonutils
+from birdie.common import log as logging
+
+jobstore_opts = [
+    cfg.StrOpt('migration_state_db',
+               default='$state_path/migrations.sqlite',
+               help='SQLite file holding the state of migration jobs'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(jobstore_opts)
+
+LOG = logging.getLogger(__name__)
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS jobs ('
+    ' id TEXT PRIMARY KEY,'
+    ' state TEXT NOT NULL,'
+    ' data TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS checkpoints ('
+    ' job_id TEXT NOT NULL,'
+    ' disk_id TEXT NOT NULL,'
+    ' data TEXT NOT NULL,'
+    ' PRIMARY KEY (job_id, disk_id))',
+)
+
+
+class JobStore(object):
+    """Jobs and checkpoints, stored as JSON rows in SQLite."""
+
+    def __init__(self, path=None):
+        self.path = path or CONF.migration_state_db
+        fileutils.ensure_tree(os.path.dirname(self.path))
+        self._conn = sqlite3.connect(self.path)
+        with self._conn:
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+
+    def save_job(self, job):
+        """Insert or update a job from its to_dict() form."""
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO jobs (id, state, data) '
+                'VALUES (?, ?, ?)',
+                (job['id'], job['state'], jsonutils.dumps(job)))
+
+    def delete_job(self, job_id):
+        with self._conn:
+            self._conn.execute('DELETE FROM checkpoints WHERE job_id = ?',
+                               (job_id,))
+            self._conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def get_jobs(self, exclude_states=()):
+        """Return the stored jobs as dicts, skipping exclude_states."""
+        rows = self._conn.execute('SELECT state, data FROM jobs')
+        return [jsonutils.loads(data) for state, data in rows
+                if state not in exclude_states]
+
+    def save_checkpoint(self, job_id, disk_id, checkpoint):
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO checkpoints (job_id, disk_id, data) '
+                'VALUES (?, ?, ?)',
+                (job_id, disk_id, jsonutils.dumps(checkpoint)))
+
+    def get_checkpoints(self, job_id):
+        """Return a dict of disk id to the last checkpoint of job_id."""
+        rows = self._conn.execute(
+            'SELECT disk_id, data FROM checkpoints WHERE job_id = ?',
+            (job_id,))
+        return dict((disk_id, jsonutils.loads(data))
+                    for disk_id, data in rows)
+
+    def clear_checkpoints(self, job_id):
+        with self._conn:
+            self._conn.execute('DELETE FROM checkpoints WHERE job_id = ?',
+                               (job_id,))
+
+    def close(self):
+        self._conn.close()
@@ -19,11 +19,18 @@ from oslo.config import cfg
 import oslo.messaging as messaging
 
 from birdie.common import log as logging
+from birdie import exception
 from birdie.i18n import _, _LE, _LI, _LW
 
+from birdie.clone.driver import incremental
+from birdie.clone.driver import throttle
+from birdie.common import importutils
+from birdie import context as birdie_context
 from birdie import manager
 from birdie import volume 
 from birdie import compute
+from birdie.server import jobs
+from birdie.server import jobstore
 from birdie.server import rpcapi
 
 CONF = cfg.CONF
@@ -51,12 +58,101 @@ class MigrationManager(manager.Manager):
 
         self._resource_tracker_dict = {}
         self._syncs_in_progress = {}
+        self.disk_sync = incremental.IncrementalSync()
+        self.io_governor = throttle.IOGovernor()
+        self.job_store = jobstore.JobStore()
+        self.migration_engine = jobs.MigrationEngine(
+            importutils.import_object(CONF.migration_task_driver, self),
+            running_by_host=self._resource_tracker_dict,
+            store=self.job_store)
         
 
         super(MigrationManager, self).__init__(service_name="birdie-migration",
                                              *args, **kwargs)
 
 
-    def get_all(self, context):
-        LOG.debug("MigrationManager get all start")
-        return
\ No newline at end of file
+    def init_host(self):
+        """Pick up the migrations interrupted by the last shutdown."""
+        resumed = self.migration_engine.resume()
+        if resumed:
+            LOG.info(_LI("Resumed %d interrupted migrations"), resumed)
+        if CONF.migration_progress_notify_interval > 0:
+            self.migration_engine.tg.add_timer(
+                CONF.migration_progress_notify_interval,
+                self._notify_migration_progress)
+
+    def cleanup_host(self):
+        """Stop the migration jobs; unfinished ones resume at startup."""
+        self.migration_engine.stop()
+
+    def _notify_migration_progress(self):
+        context = birdie_context.get_admin_context()
+        for job in self.migration_engine.list():
+            if job.state in jobs.PHASES:
+                self.notifier.info(context, 'migration.progress',
+                                   job.progress())
+
+    def get_all(self, context, sort_key=None, sort_dir='asc', after=None,
+                limit=None):
+        """Return the migration jobs known to this manager.
+
+        Without sort_key all jobs are returned by creation time; with it,
+        one keyset page, see jobs.MigrationEngine.page.
+        """
+        if sort_key is None:
+            return [job.to_dict() for job in self.migration_engine.list()]
+        return self.migration_engine.page(sort_key, sort_dir, after, limit)
+
+    def create_migration(self, context, spec, host=None, priority=0):
+        """Queue a migration job, see jobs.MigrationTask for the spec."""
+        job = self.migration_engine.submit(spec, host=host,
+                                           priority=priority)
+        return job.to_dict()
+
+    def get_migration(self, context, migration_id):
+        return self.migration_engine.get(migration_id).to_dict()
+
+    def get_migration_progress(self, context, migration_id):
+        return self.migration_engine.get(migration_id).progress()
+
+    def cancel_migration(self, context, migration_id):
+        return self.migration_engine.cancel(migration_id).to_dict()
+
+    def sync_disk(self, context, disk_id, src_path, dst_path,
+                  incremental=True):
+        """Queue a copy of a disk, transferring only the changed chunks.
+
+        A copy can take hours, so it runs as a sync_only migration job;
+        follow it with get_migration_progress.
+
+        :returns: the job, as a dict
+        """
+        spec = {'disks': [{'id': disk_id, 'src': src_path,
+                           'dst': dst_path}],
+                'incremental': incremental,
+                'sync_only': True}
+        return self.migration_engine.submit(spec).to_dict()
+
+    def _sync_disk(self, disk_id, src_path, dst_path, incremental=True,
+                   limiter=None, checkpoint=None, resume=None,
+                   progress_callback=None):
+        if disk_id in self._syncs_in_progress:
+            raise exception.InvalidInput(
+                reason=_("A sync of disk %s is already running") % disk_id)
+        self._syncs_in_progress[disk_id] = dst_path
+        try:
+            result = self.disk_sync.sync(disk_id, src_path, dst_path,
+                                         incremental=incremental,
+                                         limiter=limiter,
+                                         checkpoint=checkpoint,
+                                         resume=resume,
+                                         progress_callback=progress_callback)
+        finally:
+            self._syncs_in_progress.pop(disk_id, None)
+        LOG.info(_LI("Disk %(disk)s synced: %(result)s"),
+                 {'disk': disk_id, 'result': result})
+        return result
+
+    def reset_disk_sync(self, context, disk_id):
+        """Drop the change tracking state of a disk."""
+        self.disk_sync.reset(disk_id)
@@ -44,12 +44,44 @@ class MigrationAPI(object):
                                   version=self.BASE_RPC_API_VERSION)
         self.client = rpc.get_client(target, '1.23', serializer=None)
 
-    def get_all(self, ctxt, host):
+    def get_all(self, ctxt, host, sort_key=None, sort_dir='asc', after=None,
+                limit=None):
         
         LOG.debug("migration rpc api start")
         new_host = host
         cctxt = self.client.prepare(server=new_host, version='1.18')
-        cctxt.cast(ctxt, 'get_all')
+        return cctxt.call(ctxt, 'get_all', sort_key=sort_key,
+                          sort_dir=sort_dir, after=after, limit=limit)
 
+    def create_migration(self, ctxt, host, spec, source_host=None,
+                         priority=0):
+        cctxt = self.client.prepare(server=host, version='1.18')
+        return cctxt.call(ctxt, 'create_migration', spec=spec,
+                          host=source_host, priority=priority)
 
+    def get_migration(self, ctxt, host, migration_id):
+        cctxt = self.client.prepare(server=host, version='1.18')
+        return cctxt.call(ctxt, 'get_migration', migration_id=migration_id)
 
+    def get_migration_progress(self, ctxt, host, migration_id):
+        cctxt = self.client.prepare(server=host, version='1.18')
+        return cctxt.call(ctxt, 'get_migration_progress',
+                          migration_id=migration_id)
+
+    def cancel_migration(self, ctxt, host, migration_id):
+        cctxt = self.client.prepare(server=host, version='1.18')
+        return cctxt.call(ctxt, 'cancel_migration',
+                          migration_id=migration_id)
+
+    def sync_disk(self, ctxt, host, disk_id, src_path, dst_path,
+                  incremental=True):
+        # Only queues the sync; it returns the migration job to poll with
+        # get_migration_progress.
+        cctxt = self.client.prepare(server=host, version='1.18')
+        return cctxt.call(ctxt, 'sync_disk', disk_id=disk_id,
+                          src_path=src_path, dst_path=dst_path,
+                          incremental=incremental)
+
+    def reset_disk_sync(self, ctxt, host, disk_id):
+        cctxt = self.client.prepare(server=host, version='1.18')
+        cctxt.cast(ctxt, 'reset_disk_sync', disk_id=disk_id)
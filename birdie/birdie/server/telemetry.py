@@ -0,0 +1,139 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Progress and throughput figures of migration jobs.
+
+Every job has a JobMetrics the copy engine reports progress to. Progress
+samples go into a fixed-size ring buffer, and the rate is measured over
+the samples in the buffer, so it follows the recent throughput rather
+than the average since the start.
+"""
+
+import collections
+import time
+
+from oslo.config import cfg
+
+metrics_opts = [
+    cfg.IntOpt('migration_metrics_samples',
+               default=60,
+               help='Number of progress samples kept per migration to '
+                    'compute its transfer rate'),
+    cfg.IntOpt('migration_progress_notify_interval',
+               default=30,
+               help='Seconds between migration.progress notifications for '
+                    'running migrations. 0 disables them'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(metrics_opts)
+
+
+class JobMetrics(object):
+    """Bytes copied, rate, ETA, phase durations and retries of a job."""
+
+    def __init__(self, samples=None):
+        self._samples = collections.deque(
+            maxlen=samples or CONF.migration_metrics_samples)
+        self._disks = {}
+        self.retries = 0
+        self.phases = collections.OrderedDict()
+        self._phase = None
+        self._phase_start = None
+        self._phase_percent = None
+
+    def start_phase(self, phase):
+        self.end_phase()
+        self._phase = phase
+        self._phase_start = time.time()
+        self._phase_percent = None
+
+    def phase_progress(self, percent):
+        """Record how far, in percent, the current phase has got.
+
+        For phases that do not copy bytes, such as convert.
+        """
+        self._phase_percent = percent
+
+    @property
+    def phase_eta(self):
+        """Seconds left for the current phase from its progress, or None."""
+        percent = self._phase_percent
+        if not percent or self._phase is None:
+            return None
+        elapsed = time.time() - self._phase_start
+        return max(0.0, elapsed * (100.0 - percent) / percent)
+
+    def end_phase(self):
+        if self._phase is not None:
+            self.phases[self._phase] = (self.phases.get(self._phase, 0.0) +
+                                        time.time() - self._phase_start)
+            self._phase = None
+
+    def set_disk_total(self, disk_id, total):
+        done = self._disks.get(disk_id, (0, 0))[0]
+        self._disks[disk_id] = (done, total)
+
+    def disk_progress(self, disk_id, done, total):
+        """Record that done of the total bytes of a disk are copied."""
+        self._disks[disk_id] = (done, total)
+        self._samples.append((time.time(), self.bytes_copied))
+
+    def add_retry(self):
+        self.retries += 1
+
+    @property
+    def bytes_copied(self):
+        return sum(done for done, _total in self._disks.values())
+
+    @property
+    def bytes_total(self):
+        return sum(total for _done, total in self._disks.values())
+
+    @property
+    def rate(self):
+        """Bytes per second over the samples in the ring buffer."""
+        if len(self._samples) < 2:
+            return 0.0
+        (t0, b0), (t1, b1) = self._samples[0], self._samples[-1]
+        if t1 <= t0 or b1 <= b0:
+            return 0.0
+        return (b1 - b0) / (t1 - t0)
+
+    @property
+    def eta(self):
+        """Seconds left for the copy at the current rate, or None."""
+        rate = self.rate
+        if not rate:
+            return None
+        return max(0, self.bytes_total - self.bytes_copied) / rate
+
+    def to_dict(self):
+        phases = dict(self.phases)
+        if self._phase is not None:
+            phases[self._phase] = (phases.get(self._phase, 0.0) +
+                                   time.time() - self._phase_start)
+        eta = self.eta
+        phase_eta = self.phase_eta
+        return {'bytes_copied': self.bytes_copied,
+                'bytes_total': self.bytes_total,
+                'rate': int(self.rate),
+                'eta': int(eta) if eta is not None else None,
+                'phase': self._phase,
+                'phase_progress': self._phase_percent,
+                'phase_eta': int(phase_eta) if phase_eta is not None else None,
+                'phase_durations': dict((phase, round(seconds, 3))
+                                        for phase, seconds in phases.items()),
+                'retries': self.retries}
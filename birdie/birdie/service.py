@@ -89,6 +89,7 @@ profiler_opts = [
 CONF = cfg.CONF
 CONF.register_opts(service_opts)
 CONF.register_opts(profiler_opts, group="profiler")
+CONF.import_opt('osapi_cursor_secret', 'birdie.api.common')
 
 
 def setup_profiler(binary, host):
@@ -155,7 +156,7 @@ class Service(service.Service):
         self.model_disconnected = False
         
         ####1.init host info
-        #self.manager.init_host()
+        self.manager.init_host()
         ctxt = context.get_admin_context()
         
         #####2.create service in db#####
@@ -291,6 +292,7 @@ class Service(service.Service):
             self.rpcserver.stop()
         except Exception:
             pass
+        self.manager.cleanup_host()
         for x in self.timers:
             try:
                 x.stop()
@@ -370,6 +372,12 @@ class WSGIService(object):
                    {'worker_name': worker_name,
                     'workers': self.workers})
             raise exception.InvalidInput(msg)
+        if self.workers > 1 and not CONF.osapi_cursor_secret:
+            # A cursor signed by one worker must verify on the others.
+            msg = _("osapi_cursor_secret must be set when %(worker_name)s "
+                    "is greater than 1") % {'worker_name': '%s_workers' %
+                                            name}
+            raise exception.InvalidInput(reason=msg)
         
         self.server = wsgi.Server(name,
                                   self.app,
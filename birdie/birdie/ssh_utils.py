@@ -20,6 +20,8 @@
 
 import os
 import string
+import threading
+import time
 
 from eventlet import pools
 from oslo.config import cfg
@@ -27,8 +29,9 @@ import paramiko
 import six
 
 from birdie.common import log as logging
+from birdie.common import loopingcall
 from birdie import exception
-from birdie.i18n import _, _LI
+from birdie.i18n import _, _LE, _LI
 
 LOG = logging.getLogger(__name__)
 
@@ -46,6 +49,23 @@ ssh_opts = [
                help='File containing SSH host keys for the systems with which '
                     'Cinder needs to communicate.  OPTIONAL: '
                     'Default=$state_path/ssh_known_hosts'),
+    cfg.IntOpt('ssh_pool_min_size',
+               default=1,
+               help='Number of warm SSH connections kept open to each host'),
+    cfg.IntOpt('ssh_pool_max_size',
+               default=5,
+               help='Maximum number of SSH connections open to each host'),
+    cfg.IntOpt('ssh_pool_idle_timeout',
+               default=600,
+               help='Seconds an unused SSH connection above '
+                    'ssh_pool_min_size is kept before it is closed'),
+    cfg.IntOpt('ssh_pool_check_interval',
+               default=60,
+               help='Seconds between background health checks of pooled '
+                    'SSH connections'),
+    cfg.IntOpt('ssh_conn_timeout',
+               default=30,
+               help='SSH connection timeout in seconds'),
 ]
 
 CONF = cfg.CONF
@@ -97,6 +117,10 @@ class SSHPool(pools.Pool):
         else:
             self.hosts_key_file += ',' + CONF.ssh_hosts_key_file
 
+        self._last_used = {}
+        self.created = 0
+        self.reaped = 0
+
         super(SSHPool, self).__init__(*args, **kwargs)
 
     def create(self):
@@ -147,6 +171,10 @@ class SSHPool(pools.Pool):
                 transport = ssh.get_transport()
                 transport.sock.settimeout(None)
                 transport.set_keepalive(self.conn_timeout)
+            self.created += 1
+            # Pool.__init__ pre-warms min_size connections without put(),
+            # so they are idle from now on as far as prune() can tell.
+            self._last_used[ssh] = time.time()
             return ssh
         except Exception as e:
             msg = _("Error connecting via ssh: %s") % six.text_type(e)
@@ -166,14 +194,160 @@ class SSHPool(pools.Pool):
             if conn.get_transport().is_active():
                 return conn
             else:
+                self._last_used.pop(conn, None)
                 conn.close()
         return self.create()
 
+    def put(self, ssh):
+        """Return an ssh client to the pool and note when it became idle."""
+        self._last_used[ssh] = time.time()
+        super(SSHPool, self).put(ssh)
+
     def remove(self, ssh):
         """Close an ssh client and remove it from free_items."""
-        ssh.close()
-        ssh = None
+        self._last_used.pop(ssh, None)
         if ssh in self.free_items:
-            self.free_items.pop(ssh)
+            self.free_items.remove(ssh)
         if self.current_size > 0:
             self.current_size -= 1
+        ssh.close()
+
+    def _is_alive(self, ssh):
+        transport = ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def prune(self, idle_timeout=None):
+        """Close dead connections and those idle for too long.
+
+        Idle connections are only reaped while the pool holds more than
+        min_size connections.
+
+        :returns: number of connections closed
+        """
+        now = time.time()
+        closed = 0
+        for ssh in list(self.free_items):
+            if self._is_alive(ssh):
+                if not idle_timeout or self.current_size <= self.min_size:
+                    continue
+                if now - self._last_used.get(ssh, now) < idle_timeout:
+                    continue
+            if ssh not in self.free_items:
+                # Handed out while we were closing another connection.
+                continue
+            self.remove(ssh)
+            closed += 1
+        self.reaped += closed
+        return closed
+
+    def fill(self):
+        """Open connections until the pool holds min_size of them."""
+        while self.current_size < self.min_size:
+            self.current_size += 1
+            try:
+                ssh = self.create()
+            except paramiko.SSHException:
+                self.current_size -= 1
+                raise
+            self.put(ssh)
+
+    def stats(self):
+        free = len(self.free_items)
+        return {'size': self.current_size,
+                'free': free,
+                'in_use': self.current_size - free,
+                'waiting': self.waiting(),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'created': self.created,
+                'reaped': self.reaped}
+
+
+class SSHPoolManager(object):
+    """Keeps one warm SSHPool per remote host.
+
+    Pools are created on first use and pre-warmed to ssh_pool_min_size.
+    Once start() is called, a background looping call periodically drops
+    dead connections, closes connections idle for longer than
+    ssh_pool_idle_timeout and refills every pool to its minimum size.
+    """
+
+    def __init__(self, min_size=None, max_size=None, idle_timeout=None,
+                 check_interval=None, conn_timeout=None):
+        self.min_size = (CONF.ssh_pool_min_size if min_size is None
+                         else min_size)
+        self.max_size = (CONF.ssh_pool_max_size if max_size is None
+                         else max_size)
+        self.idle_timeout = (CONF.ssh_pool_idle_timeout
+                             if idle_timeout is None else idle_timeout)
+        self.check_interval = (CONF.ssh_pool_check_interval
+                               if check_interval is None else check_interval)
+        self.conn_timeout = (CONF.ssh_conn_timeout if conn_timeout is None
+                             else conn_timeout)
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def get_pool(self, ip, port, login, password=None, privatekey=None,
+                 **kwargs):
+        """Return the pool for (ip, port, login), creating it if needed."""
+        key = (ip, port, login)
+        pool = self._pools.get(key)
+        if pool is not None:
+            return pool
+
+        # Creating the pool opens min_size connections, which may take
+        # long or yield; do it without holding the lock.
+        new_pool = SSHPool(ip, port, self.conn_timeout, login,
+                           password=password, privatekey=privatekey,
+                           min_size=self.min_size, max_size=self.max_size,
+                           **kwargs)
+        with self._lock:
+            pool = self._pools.setdefault(key, new_pool)
+        if pool is not new_pool:
+            # Another caller created the pool meanwhile; drop ours.
+            for ssh in list(new_pool.free_items):
+                new_pool.remove(ssh)
+        return pool
+
+    def check_pools(self):
+        """Prune and refill every pool; errors on one host don't stop others.
+        """
+        for key, pool in list(self._pools.items()):
+            try:
+                closed = pool.prune(self.idle_timeout)
+                pool.fill()
+            except Exception:
+                LOG.exception(_LE("SSH pool health check failed for "
+                                  "%(ip)s:%(port)s"),
+                              {'ip': key[0], 'port': key[1]})
+                continue
+            if closed:
+                LOG.debug("Closed %(closed)d SSH connections to "
+                          "%(ip)s:%(port)s",
+                          {'closed': closed, 'ip': key[0], 'port': key[1]})
+
+    def start(self):
+        """Start the background health check."""
+        if self._checker is None:
+            self._checker = loopingcall.FixedIntervalLoopingCall(
+                self.check_pools)
+            self._checker.start(interval=self.check_interval,
+                                initial_delay=self.check_interval)
+
+    def stop(self):
+        """Stop the health check and close every idle connection."""
+        if self._checker is not None:
+            self._checker.stop()
+            self._checker = None
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            for ssh in list(pool.free_items):
+                pool.remove(ssh)
+
+    def stats(self):
+        """Return pool statistics keyed by "login@ip:port"."""
+        return dict(('%s@%s:%s' % (key[2], key[0], key[1]), pool.stats())
+                    for key, pool in list(self._pools.items()))
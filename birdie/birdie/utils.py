@@ -18,6 +18,7 @@
 """Utilities and helper functions."""
 
 
+import collections
 import contextlib
 import datetime
 import hashlib
@@ -29,6 +30,8 @@ import shutil
 import stat
 import sys
 import tempfile
+import threading
+import time
 from xml.dom import minidom
 from xml.parsers import expat
 from xml import sax
@@ -471,12 +474,75 @@ def sanitize_hostname(hostname):
 
 
 def hash_file(file_like_object):
-    """Generate a hash for the contents of a file."""
+    """Generate a hash for the contents of a file.
+
+    This reads the file serially; use
+    birdie.clone.driver.checksum.build_manifest to hash whole disks.
+    """
     checksum = hashlib.sha1()
-    any(map(checksum.update, iter(lambda: file_like_object.read(32768), '')))
+    any(map(checksum.update,
+            iter(lambda: file_like_object.read(1024 * 1024), '')))
     return checksum.hexdigest()
 
 
+class ExpiringLRUCache(object):
+    """A size-bounded, thread-safe LRU mapping whose entries expire.
+
+    Used to keep ready-made service clients around between requests.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the live value for key, or None."""
+        with self._lock:
+            try:
+                expires, value = self._items.pop(key)
+            except KeyError:
+                return None
+            if expires <= time.time():
+                return None
+            # Re-insert to mark as most recently used.
+            self._items[key] = (expires, value)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value for at most ttl seconds (the cache ttl by default)."""
+        if ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (time.time() + ttl, value)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+def token_cache_ttl(context, ttl, expiry_margin=30):
+    """Return how long a client built from context's token may be cached.
+
+    This is ttl, shortened so the entry is evicted expiry_margin seconds
+    before the context's auth token expires, when that time is known.
+    """
+    expires = getattr(context, 'auth_token_expires', None)
+    if expires is None:
+        return ttl
+    remaining = timeutils.delta_seconds(timeutils.utcnow(), expires)
+    return min(ttl, remaining - expiry_margin)
+
+
 def service_is_up(service):
     """Check whether a service is up based on last heartbeat."""
     last_heartbeat = service['updated_at'] or service['created_at']
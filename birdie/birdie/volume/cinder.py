@@ -19,6 +19,7 @@ Handles all requests relating to volumes + cinder.
 """
 
 import copy
+import hashlib
 import sys
 
 from cinderclient import client as cinder_client
@@ -36,6 +37,7 @@ from birdie.common import log as logging
 from birdie import exception
 from birdie.i18n import _
 from birdie.i18n import _LW
+from birdie import utils
 
 cinder_opts = [
     cfg.StrOpt('catalog_info',
@@ -51,6 +53,18 @@ cinder_opts = [
     cfg.IntOpt('http_retries',
                default=3,
                help='Number of cinderclient retries on failed http calls'),
+    cfg.IntOpt('client_cache_size',
+               default=128,
+               help='Maximum number of cinder clients kept for reuse across '
+                    'requests. 0 disables the cache'),
+    cfg.IntOpt('client_cache_ttl',
+               default=600,
+               help='Seconds a cached cinder client is reused; entries are '
+                    'also dropped shortly before their auth token expires'),
+    cfg.IntOpt('list_page_size',
+               default=500,
+               help='Number of volumes requested from cinder per page when '
+                    'listing volumes'),
 ]
 
 CONF = cfg.CONF
@@ -75,16 +89,51 @@ LOG = logging.getLogger(__name__)
 
 _SESSION = None
 _V1_ERROR_RAISED = False
+_CLIENT_CACHE = None
 
 
 def reset_globals():
     """Testing method to reset globals.
     """
     global _SESSION
+    global _CLIENT_CACHE
     _SESSION = None
+    _CLIENT_CACHE = None
+
+
+def _client_cache_key(context):
+    token = context.auth_token or ''
+    if isinstance(token, six.text_type):
+        token = token.encode('utf-8')
+    return (context.project_id,
+            hashlib.sha1(token).hexdigest(),
+            CONF.cinder.os_region_name,
+            CONF.cinder.catalog_info)
 
 
 def cinderclient(context):
+    """Return a cinder client for context, reusing a cached one if possible.
+
+    Endpoint lookup and version discovery only run when no live client is
+    cached for the context's project, token, region and catalog info.
+    """
+    global _CLIENT_CACHE
+
+    if _CLIENT_CACHE is None:
+        _CLIENT_CACHE = utils.ExpiringLRUCache(CONF.cinder.client_cache_size,
+                                               CONF.cinder.client_cache_ttl)
+
+    key = _client_cache_key(context)
+    client = _CLIENT_CACHE.get(key)
+    if client is None:
+        client = _create_cinderclient(context)
+        _CLIENT_CACHE.set(key, client,
+                          ttl=utils.token_cache_ttl(
+                              context, CONF.cinder.client_cache_ttl))
+    return client
+
+
+def _create_cinderclient(context):
     global _SESSION
     global _V1_ERROR_RAISED
 
@@ -131,49 +180,174 @@ def cinderclient(context):
                                 **service_parameters)
 
 
+class VolumeSummary(object):
+    """Compact, dict-like summary view of a cinder volume.
+
+    Plain fields are stored in slots. Only the raw metadata and image
+    metadata dicts of the cinder volume are kept, not the volume itself;
+    they are copied when first read, so listings that never look at them
+    skip the copies.
+    """
+
+    _FIELDS = ('id', 'status', 'size', 'availability_zone', 'created_at',
+               'attach_time', 'mountpoint', 'attach_status', 'instance_uuid',
+               'display_name', 'display_description', 'volume_type_id',
+               'snapshot_id', 'bootable')
+    _LAZY_FIELDS = ('volume_metadata', 'volume_image_metadata')
+
+    __slots__ = _FIELDS + ('_raw_metadata', '_raw_image_metadata',
+                           '_volume_metadata', '_volume_image_metadata',
+                           '_extra')
+
+    def __init__(self, vol):
+        self._raw_metadata = vol.metadata
+        # None when the volume has no image metadata at all.
+        self._raw_image_metadata = getattr(vol, 'volume_image_metadata',
+                                           None)
+        self._volume_metadata = None
+        self._volume_image_metadata = None
+        self._extra = None
+
+        self.id = vol.id
+        self.status = vol.status
+        self.size = vol.size
+        self.availability_zone = vol.availability_zone
+        self.created_at = vol.created_at
+
+        # TODO(jdg): The calling code expects attach_time and
+        #            mountpoint to be set. When the calling
+        #            code is more defensive this can be
+        #            removed.
+        self.attach_time = ""
+        self.mountpoint = ""
+
+        if vol.attachments:
+            att = vol.attachments[0]
+            self.attach_status = 'attached'
+            self.instance_uuid = att['server_id']
+            self.mountpoint = att['device']
+        else:
+            self.attach_status = 'detached'
+        # NOTE(dzyu) volume(cinder) v2 API uses 'name' instead of
+        # 'display_name', and use 'description' instead of
+        # 'display_description' for volume.
+        if hasattr(vol, 'display_name'):
+            self.display_name = vol.display_name
+            self.display_description = vol.display_description
+        else:
+            self.display_name = vol.name
+            self.display_description = vol.description
+        # TODO(jdg): Information may be lost in this translation
+        self.volume_type_id = vol.volume_type
+        self.snapshot_id = vol.snapshot_id
+        self.bootable = strutils.bool_from_string(vol.bootable)
+
+    @property
+    def volume_metadata(self):
+        if self._volume_metadata is None:
+            self._volume_metadata = dict(self._raw_metadata)
+        return self._volume_metadata
+
+    @property
+    def volume_image_metadata(self):
+        if self._volume_image_metadata is None:
+            if self._raw_image_metadata is None:
+                raise AttributeError('volume_image_metadata')
+            self._volume_image_metadata = copy.deepcopy(
+                self._raw_image_metadata)
+        return self._volume_image_metadata
+
+    def keys(self):
+        keys = [k for k in self._FIELDS if hasattr(self, k)]
+        keys.append('volume_metadata')
+        if (self._raw_image_metadata is not None or
+                self._volume_image_metadata is not None):
+            keys.append('volume_image_metadata')
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def __getitem__(self, key):
+        if key in self._FIELDS or key in self._LAZY_FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self._FIELDS:
+            setattr(self, key, value)
+        elif key in self._LAZY_FIELDS:
+            setattr(self, '_' + key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def to_dict(self):
+        return dict(self.iteritems())
+
+    def __repr__(self):
+        return '<VolumeSummary %s>' % self.id
+
+
 def _untranslate_volume_summary_view(context, vol):
     """Maps keys for volumes summary view."""
-    d = {}
-    d['id'] = vol.id
-    d['status'] = vol.status
-    d['size'] = vol.size
-    d['availability_zone'] = vol.availability_zone
-    d['created_at'] = vol.created_at
-
-    # TODO(jdg): The calling code expects attach_time and
-    #            mountpoint to be set. When the calling
-    #            code is more defensive this can be
-    #            removed.
-    d['attach_time'] = ""
-    d['mountpoint'] = ""
-
-    if vol.attachments:
-        att = vol.attachments[0]
-        d['attach_status'] = 'attached'
-        d['instance_uuid'] = att['server_id']
-        d['mountpoint'] = att['device']
-    else:
-        d['attach_status'] = 'detached'
-    # NOTE(dzyu) volume(cinder) v2 API uses 'name' instead of 'display_name',
-    # and use 'description' instead of 'display_description' for volume.
-    if hasattr(vol, 'display_name'):
-        d['display_name'] = vol.display_name
-        d['display_description'] = vol.display_description
-    else:
-        d['display_name'] = vol.name
-        d['display_description'] = vol.description
-    # TODO(jdg): Information may be lost in this translation
-    d['volume_type_id'] = vol.volume_type
-    d['snapshot_id'] = vol.snapshot_id
-    d['bootable'] = strutils.bool_from_string(vol.bootable)
-    d['volume_metadata'] = {}
-    for key, value in vol.metadata.items():
-        d['volume_metadata'][key] = value
+    return VolumeSummary(vol)
 
-    if hasattr(vol, 'volume_image_metadata'):
-        d['volume_image_metadata'] = copy.deepcopy(vol.volume_image_metadata)
 
-    return d
+def _page_client_side(items, marker=None, sort_key=None, sort_dir=None):
+    """Sort cinder volumes and skip those up to the marker.
+
+    Mirrors what cinder v2 does server-side with sort and marker: volumes
+    are ordered by (sort_key, id), and only the ones after the marker
+    volume are returned. An unknown marker returns nothing rather than
+    starting over from the first volume.
+    """
+    if sort_key:
+        def position(item):
+            # Volumes without a value sort first, whatever its type.
+            value = getattr(item, sort_key, None)
+            return (value is not None, value, item.id)
+
+        items = sorted(items, key=position,
+                       reverse=(sort_dir or 'desc') == 'desc')
+    if marker is None:
+        return items
+    for index, item in enumerate(items):
+        if item.id == marker:
+            return items[index + 1:]
+    return []
+
 
 def translate_volume_exception(method):
     """Transforms the exception for the volume but keeps its traceback intact.
@@ -232,18 +406,48 @@ class API(object):
         return _untranslate_volume_summary_view(context, item)
 
     def get_all(self, context, search_opts=None):
-        search_opts = search_opts or {}
-        items = cinderclient(context).volumes.list(detailed=True,
-                                                   search_opts=search_opts)
+        return list(self.iter_all(context, search_opts=search_opts))
 
-        rval = []
-
-        for item in items:
-            rval.append(_untranslate_volume_summary_view(context, item))
-
-        return rval
+    def iter_all(self, context, search_opts=None, page_size=None,
+                 marker=None, sort_key=None, sort_dir=None):
+        """Yield translated volumes page by page.
 
+        search_opts are passed to cinder so filtering happens server-side,
+        and only one page of volumes is held in memory at a time.
 
+        :param page_size: volumes per request, [cinder] list_page_size by
+            default
+        :param marker: ID of the last volume already seen
+        :param sort_key, sort_dir: order of the volumes; cinder resumes
+            after the marker's position in that order
+        """
+        search_opts = search_opts or {}
+        page_size = page_size or CONF.cinder.list_page_size
+        client = cinderclient(context)
+        sort = {}
+        if sort_key:
+            sort = {'sort_key': sort_key, 'sort_dir': sort_dir or 'desc'}
+
+        if isinstance(client, v1_client.Client):
+            # The v1 API has no marker/limit/sort support, so the whole
+            # listing is fetched and paged here.
+            items = client.volumes.list(detailed=True,
+                                        search_opts=search_opts)
+            for item in _page_client_side(items, marker, sort_key, sort_dir):
+                yield _untranslate_volume_summary_view(context, item)
+            return
+
+        while True:
+            items = client.volumes.list(detailed=True,
+                                        search_opts=search_opts,
+                                        marker=marker,
+                                        limit=page_size,
+                                        **sort)
+            for item in items:
+                yield _untranslate_volume_summary_view(context, item)
+            if len(items) < page_size:
+                return
+            marker = items[-1].id
 
     def migrate_volume_completion(self, context, old_volume_id, new_volume_id,
                                   error=False):